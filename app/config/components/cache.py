@@ -0,0 +1,28 @@
+import os
+import tempfile
+
+# Кеш общий для всех процессов приложения: Redis, если задан CACHE_URL,
+# иначе файловый кеш в CACHE_DIR.
+CACHE_URL = os.getenv("CACHE_URL")
+CACHE_DIR = os.getenv(
+    "CACHE_DIR", os.path.join(tempfile.gettempdir(), "movies_admin_cache")
+)
+
+if CACHE_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": CACHE_URL,
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": CACHE_DIR,
+        }
+    }
+
+# Сколько секунд хранятся ответы GET API. Изменения через модели Django
+# сбрасывают кеш сразу, прочие записи в базу становятся видны не позже.
+API_CACHE_TIMEOUT = int(os.getenv("API_CACHE_TIMEOUT", 300))
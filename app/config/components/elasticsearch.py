@@ -0,0 +1,10 @@
+import os
+
+ELASTICSEARCH_HOST = os.getenv("ES_HOST")
+ELASTICSEARCH_MOVIES_INDEX = os.getenv("ES_MOVIES_INDEX", "movies")
+ELASTICSEARCH_TIMEOUT = int(os.getenv("ES_TIMEOUT", 5))
+
+# Список и поиск фильмов API читаются из индекса ETL, а не из PostgreSQL.
+MOVIES_SEARCH_ELASTIC = bool(ELASTICSEARCH_HOST) and (
+    os.getenv("MOVIES_SEARCH_ELASTIC", "False") == "True"
+)
@@ -77,7 +77,9 @@ WSGI_APPLICATION = "config.wsgi.application"
 
 
 include(
+    "components/cache.py",
     "components/database.py",
+    "components/elasticsearch.py",
 )
 
 
@@ -140,12 +142,6 @@ LOGGING = {
     },
 }
 
-CACHES = {
-    "default": {
-        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
-    }
-}
-
 APPEND_SLASH = True
 
 TIME_ZONE = "UTC"
@@ -6,3 +6,6 @@ class MoviesConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "movies_admin"
     verbose_name = _("movies_admin")
+
+    def ready(self):
+        from movies_admin import signals  # noqa: F401
@@ -0,0 +1,162 @@
+import hashlib
+import json
+import time
+from functools import wraps
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+from rest_framework.response import Response
+
+# Версия входит в ключи ответов: при её смене все ранее сохранённые ответы
+# перестают находиться и вытесняются по таймауту. Версия - время смены
+# в наносекундах: она не повторяется, даже если ключ был потерян, а смена
+# одной записью не требует атомарного incr, которого нет у файлового кеша.
+VERSION_KEY = "api_response:version"
+
+
+def get_version() -> int:
+    return cache.get_or_set(VERSION_KEY, time.time_ns, timeout=None)
+
+
+def bump_version() -> None:
+    """Сбрасывает все кешированные ответы API."""
+    cache.set(VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def permission_key(request, view) -> str:
+    """Классы разрешений представления и уровень доступа пользователя."""
+    user = request.user
+    if user.is_staff:
+        role = "staff"
+    elif user.is_authenticated:
+        role = "user"
+    else:
+        role = "anon"
+    permissions = ",".join(type(p).__name__ for p in view.get_permissions())
+    return f"{permissions}:{role}"
+
+
+def response_cache_key(request, view) -> str:
+    """
+    Ключ ответа: адрес ресурса, параметры запроса без учёта их порядка
+    и пустых значений, разрешения пользователя и текущая версия кеша.
+    """
+    params = urlencode(
+        sorted(
+            (name, value)
+            for name, values in request.query_params.lists()
+            for value in values
+            if value != ""
+        )
+    )
+    resource = "|".join(
+        (
+            request.build_absolute_uri(request.path),
+            params,
+            permission_key(request, view),
+        )
+    )
+    digest = hashlib.sha1(resource.encode()).hexdigest()
+    return f"api_response:{get_version()}:{digest}"
+
+
+def make_etag(data) -> str:
+    body = json.dumps(data, cls=DjangoJSONEncoder, sort_keys=True)
+    return f'"{hashlib.md5(body.encode()).hexdigest()}"'
+
+
+def movie_validators(movies, envelope=None) -> tuple[str, int | None]:
+    """
+    ETag и Last-Modified фильмов по уже загруженным строкам, без сериализации.
+
+    Last-Modified - наибольшее из modified фильмов, их жанров и персон,
+    created связей (у таблиц связей нет modified) и времени смены версии
+    кеша. Удаление фильма или связи и сдвиг строк между страницами не
+    меняют modified оставшихся строк, но меняют версию. ETag учитывает ещё
+    id фильмов и связей. envelope - остальная часть ответа списка
+    (количество, ссылки на соседние страницы).
+    """
+    versions = []
+    modified = []
+    for movie in movies:
+        genre_links = movie.genre_links
+        person_roles = movie.person_roles
+        modified.append(movie.modified)
+        modified.extend(link.created for link in genre_links)
+        modified.extend(link.genre.modified for link in genre_links)
+        modified.extend(pfw.created for pfw in person_roles)
+        modified.extend(pfw.person.modified for pfw in person_roles)
+        versions.append(
+            [
+                movie.id,
+                movie.modified,
+                sorted(str(link.id) for link in genre_links),
+                sorted(str(pfw.id) for pfw in person_roles),
+            ]
+        )
+    last_modified = max(filter(None, modified), default=None)
+    timestamp = int(last_modified.timestamp()) if last_modified else 0
+    timestamp = max(timestamp, get_version() // 10**9) or None
+    return make_etag([envelope, versions]), timestamp
+
+
+def conditional_response(request, etag: str, last_modified: int | None, render):
+    """
+    304, если ETag или Last-Modified совпадают с условиями запроса, иначе
+    ответ render() с этими заголовками.
+    """
+    response = Response()
+    response["ETag"] = etag
+    if last_modified is not None:
+        response["Last-Modified"] = http_date(last_modified)
+    # Если условия запроса не выполнены, возвращается 304 (или 412), иначе
+    # сам переданный response.
+    conditional = get_conditional_response(
+        request._request, etag=etag, last_modified=last_modified, response=response
+    )
+    if conditional is not response:
+        return conditional
+    rendered = render()
+    for header in ("ETag", "Last-Modified"):
+        if header in response:
+            rendered[header] = response[header]
+    return rendered
+
+
+def cached_response(action):
+    """
+    Кеширует успешные ответы действия представления (list, retrieve).
+
+    Ответ сохраняется вместе с ETag и Last-Modified действия (или ETag по
+    телу ответа); на запрос с совпадающими If-None-Match или
+    If-Modified-Since возвращается 304 без тела.
+    """
+
+    @wraps(action)
+    def wrapper(view, request, *args, **kwargs):
+        key = response_cache_key(request, view)
+        cached = cache.get(key)
+        if cached is None:
+            response = action(view, request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            cached = {
+                "data": response.data,
+                "etag": response.get("ETag") or make_etag(response.data),
+                "last_modified": parse_http_date_safe(
+                    response.get("Last-Modified", "")
+                ),
+            }
+            cache.set(key, cached, settings.API_CACHE_TIMEOUT)
+        return conditional_response(
+            request,
+            cached["etag"],
+            cached["last_modified"],
+            lambda: Response(cached["data"]),
+        )
+
+    return wrapper
@@ -0,0 +1,62 @@
+from django.db import migrations
+
+LINK_TABLES = ("genre_film_work", "person_film_work")
+
+CREATE_CHANGE_LOG = """
+CREATE TABLE IF NOT EXISTS content.etl_change_log (
+    id bigserial PRIMARY KEY,
+    table_name text NOT NULL,
+    film_work_id uuid NOT NULL,
+    operation char(1) NOT NULL,
+    changed_at timestamp with time zone NOT NULL DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS etl_change_log_changed_at_idx
+    ON content.etl_change_log (changed_at);
+
+CREATE OR REPLACE FUNCTION content.log_film_work_link_change() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO content.etl_change_log (table_name, film_work_id, operation)
+    VALUES (TG_TABLE_NAME, OLD.film_work_id, left(TG_OP, 1));
+    IF TG_OP = 'UPDATE' AND NEW.film_work_id <> OLD.film_work_id THEN
+        INSERT INTO content.etl_change_log (table_name, film_work_id, operation)
+        VALUES (TG_TABLE_NAME, NEW.film_work_id, 'U');
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+DROP_CHANGE_LOG = """
+DROP FUNCTION IF EXISTS content.log_film_work_link_change();
+DROP TABLE IF EXISTS content.etl_change_log;
+"""
+
+CREATE_TRIGGER = """
+CREATE TRIGGER {table}_etl_change_log
+AFTER UPDATE OR DELETE ON content.{table}
+FOR EACH ROW EXECUTE FUNCTION content.log_film_work_link_change();
+"""
+
+DROP_TRIGGER = "DROP TRIGGER IF EXISTS {table}_etl_change_log ON content.{table};"
+
+
+class Migration(migrations.Migration):
+    """Журнал изменений таблиц связей для инкрементальной загрузки в ETL.
+
+    Добавление связей ETL находит по колонке created, а удаление и
+    изменение связей записываются триггером в content.etl_change_log.
+    """
+
+    dependencies = [
+        ("movies_admin", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_CHANGE_LOG, DROP_CHANGE_LOG),
+        *(
+            migrations.RunSQL(
+                CREATE_TRIGGER.format(table=table), DROP_TRIGGER.format(table=table)
+            )
+            for table in LINK_TABLES
+        ),
+    ]
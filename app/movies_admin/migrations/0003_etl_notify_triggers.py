@@ -0,0 +1,62 @@
+from django.db import migrations
+
+# Таблица -> колонка с идентификатором, который передаётся в уведомлении.
+NOTIFY_TABLES = {
+    "film_work": "id",
+    "genre": "id",
+    "person": "id",
+    "genre_film_work": "film_work_id",
+    "person_film_work": "film_work_id",
+}
+
+CREATE_NOTIFY_FUNCTION = """
+CREATE OR REPLACE FUNCTION content.notify_etl_change() RETURNS trigger AS $$
+DECLARE
+    changed record;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        changed := OLD;
+    ELSE
+        changed := NEW;
+    END IF;
+    PERFORM pg_notify(
+        'content_changes',
+        json_build_object(
+            'table', TG_TABLE_NAME,
+            'op', left(TG_OP, 1),
+            'id', to_jsonb(changed) ->> TG_ARGV[0]
+        )::text
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+DROP_NOTIFY_FUNCTION = "DROP FUNCTION IF EXISTS content.notify_etl_change();"
+
+CREATE_TRIGGER = """
+CREATE TRIGGER {table}_notify_etl
+AFTER INSERT OR UPDATE OR DELETE ON content.{table}
+FOR EACH ROW EXECUTE FUNCTION content.notify_etl_change('{column}');
+"""
+
+DROP_TRIGGER = "DROP TRIGGER IF EXISTS {table}_notify_etl ON content.{table};"
+
+
+class Migration(migrations.Migration):
+    """Уведомления NOTIFY об изменениях в схеме content для ETL."""
+
+    dependencies = [
+        ("movies_admin", "0002_etl_change_log"),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_NOTIFY_FUNCTION, DROP_NOTIFY_FUNCTION),
+        *(
+            migrations.RunSQL(
+                CREATE_TRIGGER.format(table=table, column=column),
+                DROP_TRIGGER.format(table=table),
+            )
+            for table, column in NOTIFY_TABLES.items()
+        ),
+    ]
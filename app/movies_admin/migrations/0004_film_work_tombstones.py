@@ -0,0 +1,32 @@
+from django.db import migrations
+
+CREATE_TOMBSTONE_TRIGGER = """
+CREATE OR REPLACE FUNCTION content.log_film_work_delete() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO content.etl_change_log (table_name, film_work_id, operation)
+    VALUES (TG_TABLE_NAME, OLD.id, 'D');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER film_work_etl_change_log
+AFTER DELETE ON content.film_work
+FOR EACH ROW EXECUTE FUNCTION content.log_film_work_delete();
+"""
+
+DROP_TOMBSTONE_TRIGGER = """
+DROP TRIGGER IF EXISTS film_work_etl_change_log ON content.film_work;
+DROP FUNCTION IF EXISTS content.log_film_work_delete();
+"""
+
+
+class Migration(migrations.Migration):
+    """Записи об удалённых фильмах в журнале изменений для ETL."""
+
+    dependencies = [
+        ("movies_admin", "0003_etl_notify_triggers"),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_TOMBSTONE_TRIGGER, DROP_TOMBSTONE_TRIGGER),
+    ]
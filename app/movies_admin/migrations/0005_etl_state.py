@@ -0,0 +1,23 @@
+from django.db import migrations
+
+CREATE_STATE_TABLE = """
+CREATE TABLE IF NOT EXISTS content.etl_state (
+    key text PRIMARY KEY,
+    value jsonb NOT NULL,
+    modified timestamp with time zone NOT NULL DEFAULT now()
+);
+"""
+
+DROP_STATE_TABLE = "DROP TABLE IF EXISTS content.etl_state;"
+
+
+class Migration(migrations.Migration):
+    """Таблица состояния ETL для хранилища PostgresStorage."""
+
+    dependencies = [
+        ("movies_admin", "0004_film_work_tombstones"),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_STATE_TABLE, DROP_STATE_TABLE),
+    ]
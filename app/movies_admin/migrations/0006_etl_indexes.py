@@ -0,0 +1,75 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:30
+
+from django.db import migrations, models
+
+# В базе из дампа movies_admin.sql у внешних ключей связей нет индексов,
+# а в базе, созданной миграциями, они есть под именами Django. Индекс
+# создаётся, только если столбец не является первым ни в одном индексе.
+CREATE_FK_INDEX = """
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1
+        FROM pg_index i
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+        WHERE i.indrelid = 'content.{table}'::regclass AND a.attname = '{column}'
+    ) THEN
+        CREATE INDEX {table}_{column}_idx ON content.{table} ({column});
+    END IF;
+END
+$$;
+"""
+
+DROP_FK_INDEX = "DROP INDEX IF EXISTS content.{table}_{column}_idx;"
+
+FK_COLUMNS = [
+    ("genre_film_work", "genre_id"),
+    ("genre_film_work", "film_work_id"),
+    ("person_film_work", "person_id"),
+    ("person_film_work", "film_work_id"),
+]
+
+
+class Migration(migrations.Migration):
+    """Индексы для опроса изменений ETL по (modified, id) и обратных связей."""
+
+    dependencies = [
+        ("movies_admin", "0005_etl_state"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="filmwork",
+            index=models.Index(
+                fields=["modified", "id"], name="film_work_modified_id_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="genre",
+            index=models.Index(fields=["modified", "id"], name="genre_modified_id_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="genrefilmwork",
+            index=models.Index(
+                fields=["created", "id"], name="genre_fw_created_id_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="person",
+            index=models.Index(
+                fields=["modified", "id"], name="person_modified_id_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="personfilmwork",
+            index=models.Index(
+                fields=["created", "id"], name="person_fw_created_id_idx"
+            ),
+        ),
+    ] + [
+        migrations.RunSQL(
+            CREATE_FK_INDEX.format(table=table, column=column),
+            DROP_FK_INDEX.format(table=table, column=column),
+        )
+        for table, column in FK_COLUMNS
+    ]
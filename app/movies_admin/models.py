@@ -17,6 +17,9 @@ class Genre(UUIDMixin, TimeStampedMixin):
 
     class Meta:
         db_table = 'content"."genre'
+        indexes = [
+            models.Index(fields=["modified", "id"], name="genre_modified_id_idx")
+        ]
         verbose_name = _("genre")
         verbose_name_plural = _("genres")
 
@@ -38,6 +41,9 @@ class Filmwork(UUIDMixin, TimeStampedMixin):
 
     class Meta:
         db_table = 'content"."film_work'
+        indexes = [
+            models.Index(fields=["modified", "id"], name="film_work_modified_id_idx")
+        ]
         verbose_name = _("film work")
         verbose_name_plural = _("film works")
 
@@ -50,6 +56,9 @@ class Person(UUIDMixin, TimeStampedMixin):
 
     class Meta:
         db_table = 'content"."person'
+        indexes = [
+            models.Index(fields=["modified", "id"], name="person_modified_id_idx")
+        ]
         verbose_name = _("person")
         verbose_name_plural = _("persons")
 
@@ -61,6 +70,9 @@ class GenreFilmwork(UUIDMixin):
 
     class Meta:
         db_table = 'content"."genre_film_work'
+        indexes = [
+            models.Index(fields=["created", "id"], name="genre_fw_created_id_idx")
+        ]
 
 
 class PersonFilmwork(UUIDMixin):
@@ -71,3 +83,6 @@ class PersonFilmwork(UUIDMixin):
 
     class Meta:
         db_table = 'content"."person_film_work'
+        indexes = [
+            models.Index(fields=["created", "id"], name="person_fw_created_id_idx")
+        ]
@@ -1,25 +1,216 @@
-from rest_framework import pagination
+import hashlib
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import F, Q
+from rest_framework import filters, pagination
+from rest_framework.exceptions import NotFound
 from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+# Сколько секунд хранится точное количество строк отфильтрованного списка,
+# которое отдаётся как приблизительное.
+APPROXIMATE_COUNT_TIMEOUT = 300
 
 
 class TotalPagesCountPaginator(pagination.PageNumberPagination):
     def get_paginated_response(self, data):
-        previous_page_number = (
-            self.page.paginator.page(self.page.number - 1).number
-            if self.page.has_previous()
-            else None
-        )
-        next_page_number = (
-            self.page.paginator.page(self.page.number + 1).number
-            if self.page.has_next()
-            else None
-        )
         return Response(
             {
                 "count": self.page.paginator.count,
                 "total_pages": self.page.paginator.num_pages,
-                "prev": previous_page_number,
-                "next": next_page_number,
+                "prev": (
+                    self.page.previous_page_number()
+                    if self.page.has_previous()
+                    else None
+                ),
+                "next": self.page.next_page_number() if self.page.has_next() else None,
+                "results": data,
+            }
+        )
+
+
+def approximate_count(queryset) -> int:
+    """
+    Приблизительное количество строк queryset без COUNT(*) на каждый запрос.
+
+    Для списка без фильтров берётся оценка планировщика pg_class.reltuples,
+    которую обновляют autovacuum и ANALYZE. Для отфильтрованного списка
+    (и для таблицы, по которой ещё не собрана статистика) точное количество
+    считается один раз и кешируется на APPROXIMATE_COUNT_TIMEOUT секунд.
+    """
+    if not queryset.query.has_filters():
+        connection = connections[queryset.db]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                [connection.ops.quote_name(queryset.model._meta.db_table)],
+            )
+            row = cursor.fetchone()
+        if row and row[0] > 0:
+            return row[0]
+    query_hash = hashlib.sha1(str(queryset.query).encode()).hexdigest()
+    return cache.get_or_set(
+        f"approximate_count:{query_hash}", queryset.count, APPROXIMATE_COUNT_TIMEOUT
+    )
+
+
+class KeysetPaginator(pagination.BasePagination):
+    """
+    Постраничный вывод по курсору на (поле сортировки, id).
+
+    Следующая страница выбирается условием (field, id) > (значения последней
+    строки), а не OFFSET, поэтому время ответа не зависит от глубины страницы.
+    Сортировка задаётся тем же параметром ordering, что и для OrderingFilter
+    (учитывается первое поле), id добавляется последним, чтобы порядок был
+    однозначным при одинаковых значениях поля.
+
+    Количество строк по умолчанию не считается; count=approximate возвращает
+    оценку approximate_count, count=exact - результат COUNT(*).
+
+    Включается для запроса параметром pagination=cursor, ссылки next и prev
+    выбирают его параметром cursor. Без них ответ остаётся прежним.
+    """
+
+    page_size = TotalPagesCountPaginator.page_size
+    cursor_query_param = "cursor"
+    count_query_param = "count"
+    pagination_query_param = "pagination"
+    pagination_query_value = "cursor"
+    invalid_cursor_message = "Invalid cursor"
+
+    @classmethod
+    def is_requested(cls, request) -> bool:
+        params = request.query_params
+        return (
+            params.get(cls.pagination_query_param) == cls.pagination_query_value
+            or cls.cursor_query_param in params
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.field, self.descending = self.get_ordering(request, view)
+        cursor = self.decode_cursor(request, queryset.model)
+        self.reverse = bool(cursor and cursor["reverse"])
+        self.count = self.get_count(queryset, request)
+
+        # NULL значения поля идут в конце списка, при обратном обходе
+        # (ссылка prev) - в начале.
+        descending = self.descending != self.reverse
+        nulls_last = not self.reverse
+        if self.field == "id":
+            queryset = queryset.order_by("-id" if descending else "id")
+        elif descending:
+            queryset = queryset.order_by(
+                F(self.field).desc(nulls_last=nulls_last), F("id").desc()
+            )
+        else:
+            queryset = queryset.order_by(
+                F(self.field).asc(nulls_last=nulls_last), F("id").asc()
+            )
+        if cursor is not None:
+            queryset = queryset.filter(
+                self.after(cursor["value"], cursor["id"], descending, nulls_last)
+            )
+
+        rows = list(queryset[: self.page_size + 1])
+        page = rows[: self.page_size]
+        has_more = len(rows) > self.page_size
+        if self.reverse:
+            page.reverse()
+            self.has_previous, self.has_next = has_more, True
+        else:
+            self.has_previous, self.has_next = cursor is not None, has_more
+        self.page = page
+        return page
+
+    def get_paginated_response(self, data):
+        return Response(
+            {
+                "count": self.count,
+                "prev": self.get_previous_link(),
+                "next": self.get_next_link(),
                 "results": data,
             }
         )
+
+    def get_ordering(self, request, view) -> tuple[str, bool]:
+        """Первое поле параметра ordering из ordering_fields представления."""
+        ordering = request.query_params.get(filters.OrderingFilter.ordering_param, "")
+        allowed = set(getattr(view, "ordering_fields", None) or ())
+        for term in filter(None, (term.strip() for term in ordering.split(","))):
+            if term.lstrip("-") in allowed:
+                return term.lstrip("-"), term.startswith("-")
+        return "id", False
+
+    def get_count(self, queryset, request) -> int | None:
+        mode = request.query_params.get(self.count_query_param)
+        if mode == "exact":
+            return queryset.count()
+        if mode == "approximate":
+            return approximate_count(queryset)
+        return None
+
+    def after(self, value, pk, descending: bool, nulls_last: bool = True) -> Q:
+        """
+        Строки после позиции (value, pk) в порядке сортировки страницы.
+
+        :param nulls_last: NULL значения поля идут после остальных.
+        """
+        lookup = "lt" if descending else "gt"
+        if self.field == "id":
+            return Q(**{f"id__{lookup}": pk})
+        is_null = Q(**{f"{self.field}__isnull": True})
+        if value is None:
+            same_value = is_null & Q(**{f"id__{lookup}": pk})
+            return same_value if nulls_last else ~is_null | same_value
+        after = Q(**{f"{self.field}__{lookup}": value}) | Q(
+            **{self.field: value, f"id__{lookup}": pk}
+        )
+        return after | is_null if nulls_last else after
+
+    def get_next_link(self) -> str | None:
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self) -> str | None:
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def encode_cursor(self, instance, reverse: bool) -> str:
+        field = instance._meta.get_field(self.field)
+        value = field.value_from_object(instance)
+        position = {
+            "ordering": f"{'-' if self.descending else ''}{self.field}",
+            "value": None if value is None else field.value_to_string(instance),
+            "id": str(instance.pk),
+            "reverse": reverse,
+        }
+        cursor = urlsafe_b64encode(json.dumps(position).encode()).decode()
+        url = remove_query_param(self.base_url, self.pagination_query_param)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request, model) -> dict | None:
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            position = json.loads(urlsafe_b64decode(encoded.encode()))
+            ordering = f"{'-' if self.descending else ''}{self.field}"
+            if position["ordering"] != ordering:
+                raise ValueError("Cursor was issued for another ordering.")
+            if position["value"] is not None:
+                position["value"] = model._meta.get_field(self.field).to_python(
+                    position["value"]
+                )
+            position["id"] = model._meta.pk.to_python(position["id"])
+            position["reverse"] = bool(position["reverse"])
+        except (KeyError, TypeError, ValueError, ValidationError) as e:
+            raise NotFound(self.invalid_cursor_message) from e
+        return position
@@ -0,0 +1,140 @@
+from collections.abc import Sequence
+from functools import cached_property, lru_cache
+
+from django.conf import settings
+from elasticsearch import Elasticsearch
+
+SEARCH_FIELDS = (
+    "title^3",
+    "description",
+    "genres",
+    "actors_names",
+    "directors_names",
+    "writers_names",
+)
+# Поле параметра ordering API -> поле сортировки индекса movies.
+ORDERING_FIELDS = {"id": "id", "title": "title.raw", "rating": "imdb_rating"}
+# Глубже окна from/size (index.max_result_window) листаем через search_after.
+MAX_RESULT_WINDOW = 10000
+
+
+@lru_cache(maxsize=None)
+def get_client() -> Elasticsearch:
+    return Elasticsearch(
+        settings.ELASTICSEARCH_HOST, request_timeout=settings.ELASTICSEARCH_TIMEOUT
+    )
+
+
+def build_query(search: str) -> dict:
+    """Полнотекстовый запрос по полям индекса с анализатором ru_en."""
+    if not search:
+        return {"match_all": {}}
+    return {
+        "multi_match": {"query": search, "fields": list(SEARCH_FIELDS)},
+    }
+
+
+def build_sort(ordering: str, search: str) -> list | None:
+    """
+    Сортировка индекса по параметру ordering в формате OrderingFilter.
+
+    Последним всегда идёт id, чтобы порядок был однозначным для search_after.
+    Возвращает None, если поле нельзя отсортировать по индексу.
+    """
+    sort = []
+    for term in filter(None, (term.strip() for term in ordering.split(","))):
+        field = ORDERING_FIELDS.get(term.lstrip("-"))
+        if field is None:
+            return None
+        sort.append({field: "desc" if term.startswith("-") else "asc"})
+    if not sort and search:
+        sort.append({"_score": "desc"})
+    sort.append({"id": "asc"})
+    return sort
+
+
+class MovieSearchResults:
+    """
+    Ленивый список id фильмов из индекса movies.
+
+    Реализует интерфейс, который нужен django Paginator (count и срезы),
+    поэтому постраничный вывод и формат ответа TotalPagesCountPaginator
+    остаются прежними. Запросы в Elasticsearch выполняются только при
+    обращении к количеству или к данным страницы.
+    """
+
+    def __init__(self, query: dict, sort: list, client=None, index: str = None):
+        self.query = query
+        self.sort = sort
+        self.client = client or get_client()
+        self.index = index or settings.ELASTICSEARCH_MOVIES_INDEX
+
+    @cached_property
+    def total(self) -> int:
+        return self.client.count(index=self.index, query=self.query)["count"]
+
+    def count(self) -> int:
+        return self.total
+
+    def __len__(self) -> int:
+        return self.total
+
+    def __getitem__(self, key: slice) -> "MovieSearchPage":
+        if not isinstance(key, slice):
+            raise TypeError("MovieSearchResults supports only slicing.")
+        return MovieSearchPage(self, key.start or 0, key.stop)
+
+    def fetch_ids(self, start: int, stop: int) -> list[str]:
+        """Идентификаторы фильмов с позиции start по stop."""
+        if stop <= MAX_RESULT_WINDOW:
+            hits = self._search(size=stop - start, from_=start)
+        else:
+            search_after = self._skip(start)
+            if start and search_after is None:
+                return []
+            hits = self._search(size=stop - start, search_after=search_after)
+        return [hit["_id"] for hit in hits]
+
+    def _skip(self, offset: int) -> list | None:
+        """Значения сортировки документа на позиции offset - 1."""
+        search_after = None
+        while offset > 0:
+            size = min(offset, MAX_RESULT_WINDOW)
+            hits = self._search(size=size, search_after=search_after)
+            if not hits:
+                return None
+            search_after = hits[-1]["sort"]
+            offset -= len(hits)
+        return search_after
+
+    def _search(self, size: int, **params) -> list[dict]:
+        response = self.client.search(
+            index=self.index,
+            query=self.query,
+            sort=self.sort,
+            size=size,
+            source=False,
+            track_total_hits=False,
+            filter_path=["hits.hits._id", "hits.hits.sort"],
+            **{key: value for key, value in params.items() if value is not None},
+        )
+        return response.get("hits", {}).get("hits", [])
+
+
+class MovieSearchPage(Sequence):
+    """Срез MovieSearchResults, загружаемый при первом обращении."""
+
+    def __init__(self, results: MovieSearchResults, start: int, stop: int):
+        self.results = results
+        self.start = start
+        self.stop = stop
+
+    @cached_property
+    def ids(self) -> list[str]:
+        return self.results.fetch_ids(self.start, self.stop)
+
+    def __getitem__(self, index):
+        return self.ids[index]
+
+    def __len__(self) -> int:
+        return len(self.ids)
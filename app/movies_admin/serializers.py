@@ -47,5 +47,8 @@ class FilmWorkSerializer(serializers.ModelSerializer):
         return self._get_people_by_role(obj, "writer")
 
     def _get_people_by_role(self, obj, role):
-        people = obj.personfilmwork_set.filter(role=role).select_related("person")
-        return [person.person.full_name for person in people]
+        # person_roles заполняется prefetch во FilmWorkListViewSet; для объектов
+        # без prefetch участники загружаются один раз на все три роли.
+        if not hasattr(obj, "person_roles"):
+            obj.person_roles = list(obj.personfilmwork_set.select_related("person"))
+        return [pfw.person.full_name for pfw in obj.person_roles if pfw.role == role]
@@ -0,0 +1,25 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from movies_admin.cache import bump_version
+from movies_admin.models import (
+    Filmwork,
+    Genre,
+    GenreFilmwork,
+    Person,
+    PersonFilmwork,
+)
+
+# Модели, изменения которых видны в ответах API.
+CACHED_MODELS = (Filmwork, Genre, Person, GenreFilmwork, PersonFilmwork)
+
+
+def invalidate_api_cache(sender, action=None, **kwargs):
+    # m2m_changed приходит до и после изменения связей, достаточно второго.
+    if action is None or action.startswith("post_"):
+        bump_version()
+
+
+for model in CACHED_MODELS:
+    post_save.connect(invalidate_api_cache, sender=model)
+    post_delete.connect(invalidate_api_cache, sender=model)
+# Filmwork.genres.add()/remove() меняют связи без сигналов post_save.
+m2m_changed.connect(invalidate_api_cache, sender=Filmwork.genres.through)
@@ -1,3 +1,385 @@
-from django.test import TestCase
+import tempfile
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from movies_admin.cache import (
+    VERSION_KEY,
+    bump_version,
+    cached_response,
+    get_version,
+    movie_validators,
+)
+from movies_admin.models import Filmwork, Genre, Person, PersonFilmwork
+from movies_admin.paginators import KeysetPaginator
+from movies_admin.search import MAX_RESULT_WINDOW, MovieSearchResults, build_sort
+from rest_framework.exceptions import NotFound
+from rest_framework.permissions import AllowAny
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework.viewsets import ViewSet
+
+MOVIES_URL = "/api/v1/movies/"
+LOCMEM_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class FilmWorkListQueriesTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.genre = Genre.objects.create(name="Drama")
+
+    def create_movies(self, count):
+        for i in range(count):
+            movie = Filmwork.objects.create(title=f"Movie {i}", rating=5, type="movie")
+            movie.genres.add(self.genre)
+            for role in ("actor", "director", "writer"):
+                person = Person.objects.create(full_name=f"{role} {i}")
+                PersonFilmwork.objects.create(person=person, film_work=movie, role=role)
+
+    def count_list_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(MOVIES_URL)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), response.json()
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        self.create_movies(2)
+        small_page_queries, _ = self.count_list_queries()
+        self.create_movies(20)
+        large_page_queries, data = self.count_list_queries()
+
+        self.assertEqual(len(data["results"]), 22)
+        self.assertEqual(small_page_queries, large_page_queries)
+
+    def test_people_grouped_by_role(self):
+        self.create_movies(1)
+        _, data = self.count_list_queries()
+        movie = data["results"][0]
+
+        self.assertEqual(movie["genres"], ["Drama"])
+        self.assertEqual(movie["actors"], ["actor 0"])
+        self.assertEqual(movie["directors"], ["director 0"])
+        self.assertEqual(movie["writers"], ["writer 0"])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class FilmWorkCursorPaginationTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        for i in range(7):
+            Filmwork.objects.create(title=f"Movie {i}", rating=i % 2, type="movie")
+
+    def walk(self, url):
+        ids = []
+        while url:
+            data = self.client.get(url).json()
+            ids.extend(movie["id"] for movie in data["results"])
+            url = data["next"]
+        return ids, data
+
+    def test_pages_cover_equal_values_once(self):
+        with mock.patch.object(KeysetPaginator, "page_size", 2):
+            ids, data = self.walk(f"{MOVIES_URL}?pagination=cursor&ordering=-rating")
+        expected = Filmwork.objects.order_by("-rating", "-id").values_list("id")
+
+        self.assertEqual(ids, [str(pk) for pk, in expected])
+        self.assertIsNone(data["count"])
+
+    def test_prev_returns_previous_page(self):
+        first = self.client.get(f"{MOVIES_URL}?pagination=cursor&ordering=title")
+        second = self.client.get(first.json()["next"])
+        back = self.client.get(second.json()["prev"])
+
+        self.assertEqual(back.json()["results"], first.json()["results"])
+        self.assertIsNone(first.json()["prev"])
+
+    def test_null_rating_rows_are_paged_last(self):
+        # В базе из movies_admin.sql rating допускает NULL.
+        movie = Filmwork.objects.order_by("id").first()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'ALTER TABLE "content"."film_work" ALTER COLUMN rating DROP NOT NULL'
+            )
+            cursor.execute(
+                'UPDATE "content"."film_work" SET rating = NULL WHERE id = %s',
+                [movie.id],
+            )
+        url = f"{MOVIES_URL}?pagination=cursor&ordering=-rating"
+        with mock.patch.object(KeysetPaginator, "page_size", 2):
+            ids, _ = self.walk(url)
+            last = self.client.get(url).json()
+            while last["next"]:
+                last = self.client.get(last["next"]).json()
+            previous = self.client.get(last["prev"])
+
+        self.assertEqual(len(ids), 7)
+        self.assertEqual(ids[-1], str(movie.id))
+        self.assertEqual(previous.status_code, 200)
+        self.assertEqual(len(previous.json()["results"]), 2)
+
+    def test_exact_count(self):
+        data = self.client.get(f"{MOVIES_URL}?pagination=cursor&count=exact").json()
+
+        self.assertEqual(data["count"], 7)
+
+
+class KeysetPaginatorTest(SimpleTestCase):
+    def request(self, **params):
+        return Request(APIRequestFactory().get(MOVIES_URL, params))
+
+    def paginator(self, ordering):
+        paginator = KeysetPaginator()
+        paginator.base_url = f"http://testserver{MOVIES_URL}?pagination=cursor"
+        paginator.field, paginator.descending = ordering.lstrip("-"), ordering[0] == "-"
+        return paginator
+
+    def test_selected_per_request(self):
+        self.assertFalse(KeysetPaginator.is_requested(self.request(page=2)))
+        self.assertTrue(KeysetPaginator.is_requested(self.request(pagination="cursor")))
+        self.assertTrue(KeysetPaginator.is_requested(self.request(cursor="abc")))
+
+    def test_cursor_round_trip(self):
+        paginator = self.paginator("-rating")
+        movie = Filmwork(title="Movie", rating=7.5, type="movie")
+        link = paginator.encode_cursor(movie, reverse=True)
+        cursor = link.split("cursor=")[-1]
+
+        self.assertNotIn("pagination=", link)
+        position = paginator.decode_cursor(self.request(cursor=cursor), Filmwork)
+        self.assertEqual(position["value"], 7.5)
+        self.assertEqual(position["id"], movie.id)
+        self.assertTrue(position["reverse"])
+
+    def test_cursor_on_null_value(self):
+        paginator = self.paginator("-rating")
+        link = paginator.encode_cursor(Filmwork(title="Movie"), reverse=False)
+        request = self.request(cursor=link.split("cursor=")[-1])
+
+        self.assertIsNone(paginator.decode_cursor(request, Filmwork)["value"])
+
+    def test_cursor_for_other_ordering_is_rejected(self):
+        link = self.paginator("title").encode_cursor(Filmwork(title="A"), reverse=False)
+        request = self.request(cursor=link.split("cursor=")[-1])
+
+        with self.assertRaises(NotFound):
+            self.paginator("-title").decode_cursor(request, Filmwork)
+        with self.assertRaises(NotFound):
+            self.paginator("title").decode_cursor(self.request(cursor="%%%"), Filmwork)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ConditionalGetTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.movie = Filmwork.objects.create(title="Movie", rating=5, type="movie")
+        self.url = f"{MOVIES_URL}{self.movie.id}/"
+
+    def test_list_not_modified(self):
+        response = self.client.get(MOVIES_URL)
+        by_etag = self.client.get(MOVIES_URL, HTTP_IF_NONE_MATCH=response["ETag"])
+        by_date = self.client.get(
+            MOVIES_URL, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"]
+        )
+
+        self.assertEqual(by_etag.status_code, 304)
+        self.assertEqual(by_date.status_code, 304)
+
+    def test_list_modified_after_delete(self):
+        other = Filmwork.objects.create(title="Other", rating=5, type="movie")
+        last_modified = self.client.get(MOVIES_URL)["Last-Modified"]
+        # Удаление позже на секунды, которыми ограничена точность Last-Modified.
+        later = time.time_ns() + 10 * 10**9
+        with mock.patch("time.time_ns", return_value=later):
+            other.delete()
+        response = self.client.get(MOVIES_URL, HTTP_IF_MODIFIED_SINCE=last_modified)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["count"], 1)
+
+    def test_new_person_changes_detail_etag(self):
+        etag = self.client.get(self.url)["ETag"]
+        person = Person.objects.create(full_name="Actor")
+        PersonFilmwork.objects.create(person=person, film_work=self.movie, role="actor")
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["actors"], ["Actor"])
+
+
+class MovieValidatorsTest(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch("movies_admin.cache.get_version", return_value=0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def movie(self, day, genre_day=None):
+        links = []
+        if genre_day:
+            created = datetime(2024, 1, genre_day, tzinfo=timezone.utc)
+            links.append(
+                SimpleNamespace(
+                    id="link", created=created, genre=SimpleNamespace(modified=created)
+                )
+            )
+        return SimpleNamespace(
+            id=f"movie-{day}",
+            modified=datetime(2024, 1, day, tzinfo=timezone.utc),
+            genre_links=links,
+            person_roles=[],
+        )
+
+    def test_last_modified_includes_related_rows(self):
+        _, last_modified = movie_validators([self.movie(1, genre_day=5), self.movie(3)])
+
+        self.assertEqual(
+            last_modified, datetime(2024, 1, 5, tzinfo=timezone.utc).timestamp()
+        )
+
+    def test_last_modified_includes_version_change(self):
+        changed_at = datetime(2024, 2, 1, tzinfo=timezone.utc).timestamp()
+        with mock.patch(
+            "movies_admin.cache.get_version", return_value=int(changed_at) * 10**9
+        ):
+            _, last_modified = movie_validators([self.movie(1, genre_day=5)])
+
+        self.assertEqual(last_modified, changed_at)
+
+    def test_etag_depends_on_rows_and_envelope(self):
+        etag, _ = movie_validators([self.movie(1)], {"next": 2})
+
+        self.assertEqual(etag, movie_validators([self.movie(1)], {"next": 2})[0])
+        self.assertNotEqual(etag, movie_validators([self.movie(1)], {"next": 3})[0])
+        self.assertNotEqual(etag, movie_validators([self.movie(1, 1)], {"next": 2})[0])
+
+
+class CountingViewSet(ViewSet):
+    authentication_classes = ()
+    permission_classes = (AllowAny,)
+    throttle_classes = ()
+    calls = 0
+
+    @cached_response
+    def list(self, request):
+        CountingViewSet.calls += 1
+        return Response({"calls": CountingViewSet.calls})
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CachedResponseTest(SimpleTestCase):
+    view = staticmethod(CountingViewSet.as_view({"get": "list"}))
+
+    def setUp(self):
+        cache.clear()
+        CountingViewSet.calls = 0
+
+    def get(self, query="", **headers):
+        return self.view(APIRequestFactory().get(f"{MOVIES_URL}?{query}", **headers))
+
+    def test_params_order_does_not_matter(self):
+        first = self.get("page=2&ordering=title")
+        second = self.get("ordering=title&page=2&search=")
+
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(CountingViewSet.calls, 1)
+        self.assertEqual(self.get("page=3").data, {"calls": 2})
+
+    def test_if_none_match_returns_not_modified(self):
+        etag = self.get()["ETag"]
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(CountingViewSet.calls, 1)
+
+    def test_version_bump_invalidates(self):
+        etag = self.get()["ETag"]
+        bump_version()
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {"calls": 2})
+
+
+class CacheVersionTest(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        caches = {
+            "default": {
+                "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                "LOCATION": directory.name,
+            }
+        }
+        settings = override_settings(CACHES=caches)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_bumped_version_does_not_expire(self):
+        version = get_version()
+        bump_version()
+        bumped = get_version()
+
+        self.assertNotEqual(bumped, version)
+        # Таймаут кеша по умолчанию - 300 секунд.
+        with mock.patch("time.time", return_value=time.time() + 86400):
+            self.assertEqual(cache.get(VERSION_KEY), bumped)
+
+
+class FakeElasticsearch:
+    """Индекс из n документов, отсортированных по id."""
+
+    def __init__(self, n):
+        self.ids = [f"{i:032x}" for i in range(n)]
+        self.searches = []
+
+    def count(self, index, query):
+        return {"count": len(self.ids)}
+
+    def search(self, size, from_=0, search_after=None, **kwargs):
+        self.searches.append((size, from_, search_after))
+        start = from_ if search_after is None else search_after[0] + 1
+        hits = [
+            {"_id": self.ids[i], "sort": [i]}
+            for i in range(start, min(start + size, len(self.ids)))
+        ]
+        return {"hits": {"hits": hits}}
+
+
+class MovieSearchTest(SimpleTestCase):
+    def paginate(self, n, page_number, per_page=50):
+        client = FakeElasticsearch(n)
+        results = MovieSearchResults({"match_all": {}}, [], client, "movies")
+        return client, Paginator(results, per_page).page(page_number)
+
+    def test_sort_always_ends_with_id(self):
+        self.assertEqual(
+            build_sort("-rating,title", ""),
+            [{"imdb_rating": "desc"}, {"title.raw": "asc"}, {"id": "asc"}],
+        )
+        self.assertEqual(build_sort("", "star"), [{"_score": "desc"}, {"id": "asc"}])
+
+    def test_unsupported_ordering_falls_back_to_postgres(self):
+        self.assertIsNone(build_sort("created", ""))
+
+    def test_page_inside_result_window(self):
+        client, page = self.paginate(1000, 3)
+
+        self.assertEqual(page[0], f"{100:032x}")
+        self.assertEqual(client.searches, [(50, 100, None)])
+
+    def test_deep_page_uses_search_after(self):
+        client, page = self.paginate(MAX_RESULT_WINDOW * 2, 300)
+
+        self.assertEqual(list(page)[0], f"{299 * 50:032x}")
+        self.assertEqual(len(page), 50)
+        self.assertTrue(all(from_ == 0 for _, from_, _ in client.searches))
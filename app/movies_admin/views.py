@@ -1,9 +1,26 @@
-from movies_admin.models import Filmwork, Genre
+import logging
+from typing import List
+from uuid import UUID
+
+from django.conf import settings
+from django.db.models import Prefetch
+from elasticsearch import ApiError, TransportError
+from movies_admin.cache import (
+    cached_response,
+    conditional_response,
+    movie_validators,
+)
+from movies_admin.models import Filmwork, Genre, GenreFilmwork, PersonFilmwork
+from movies_admin.paginators import KeysetPaginator
+from movies_admin.search import MovieSearchResults, build_query, build_sort
 from movies_admin.serializers import FilmWorkSerializer, GenreSerializer
 from rest_framework import filters
 from rest_framework.permissions import IsAuthenticatedOrReadOnly
+from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet
 
+logger = logging.getLogger(__name__)
+
 
 class GenreViewSet(ModelViewSet):
     queryset = Genre.objects.all().order_by("id")
@@ -11,7 +28,24 @@ class GenreViewSet(ModelViewSet):
 
 
 class FilmWorkListViewSet(ModelViewSet):
-    queryset = Filmwork.objects.all().order_by("id")
+    # Жанры, связи с жанрами и участники загружаются тремя запросами на всю
+    # страницу, FilmWorkSerializer и movie_validators читают их из кеша
+    # prefetch.
+    queryset = Filmwork.objects.prefetch_related(
+        "genres",
+        Prefetch(
+            "genrefilmwork_set",
+            queryset=GenreFilmwork.objects.select_related("genre").only(
+                "id", "film_work", "created", "genre", "genre__modified"
+            ),
+            to_attr="genre_links",
+        ),
+        Prefetch(
+            "personfilmwork_set",
+            queryset=PersonFilmwork.objects.select_related("person"),
+            to_attr="person_roles",
+        ),
+    ).order_by("id")
     serializer_class = FilmWorkSerializer
     permission_classes = (IsAuthenticatedOrReadOnly,)
     filter_backends = (
@@ -20,3 +54,79 @@ class FilmWorkListViewSet(ModelViewSet):
     )
     search_fields = ("title", "created", "genres")
     ordering_fields = ("title", "rating", "created")
+
+    @property
+    def paginator(self):
+        """KeysetPaginator для запросов с pagination=cursor или cursor."""
+        if not hasattr(self, "_paginator") and KeysetPaginator.is_requested(
+            self.request
+        ):
+            self._paginator = KeysetPaginator()
+        return super().paginator
+
+    @cached_response
+    def list(self, request, *args, **kwargs):
+        """
+        Список фильмов.
+
+        При MOVIES_SEARCH_ELASTIC поиск, сортировка и постраничный вывод
+        выполняются по индексу movies, а фильмы страницы загружаются из
+        PostgreSQL по id. Если индекс не поддерживает запрошенную сортировку
+        или недоступен, а также при постраничном выводе по курсору список
+        строится по PostgreSQL.
+
+        ETag и Last-Modified считаются по загруженным фильмам страницы до
+        сериализации, на совпадающий условный запрос возвращается 304.
+        """
+        movies = None
+        results = self.search_movies(request)
+        if results is not None:
+            try:
+                page = self.paginate_queryset(results)
+                movies = self.get_movies_by_ids(page)
+            except (ApiError, TransportError) as e:
+                logger.warning("Movies search in Elasticsearch failed: %s", e)
+        if movies is None:
+            movies = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+        if movies is None:
+            return super().list(request, *args, **kwargs)
+
+        # Ответ без списка фильмов: количество и ссылки на соседние страницы.
+        envelope = self.get_paginated_response([]).data
+        etag, last_modified = movie_validators(movies, envelope)
+        return conditional_response(
+            request,
+            etag,
+            last_modified,
+            lambda: self.get_paginated_response(
+                self.get_serializer(movies, many=True).data
+            ),
+        )
+
+    @cached_response
+    def retrieve(self, request, *args, **kwargs):
+        movie = self.get_object()
+        etag, last_modified = movie_validators([movie])
+        return conditional_response(
+            request,
+            etag,
+            last_modified,
+            lambda: Response(self.get_serializer(movie).data),
+        )
+
+    def search_movies(self, request) -> MovieSearchResults | None:
+        if not settings.MOVIES_SEARCH_ELASTIC or isinstance(
+            self.paginator, KeysetPaginator
+        ):
+            return None
+        search = request.query_params.get(filters.SearchFilter.search_param, "")
+        ordering = request.query_params.get(filters.OrderingFilter.ordering_param, "")
+        sort = build_sort(ordering, search)
+        if sort is None:
+            return None
+        return MovieSearchResults(build_query(search), sort)
+
+    def get_movies_by_ids(self, ids: List[str]) -> List[Filmwork]:
+        """Фильмы в порядке ids; отсутствующие в PostgreSQL пропускаются."""
+        movies = self.get_queryset().in_bulk([UUID(movie_id) for movie_id in ids])
+        return [movies[UUID(movie_id)] for movie_id in ids if UUID(movie_id) in movies]
@@ -1,8 +1,13 @@
 import asyncio
-import json
+import os
 
 from elasticsearch import AsyncElasticsearch
 
+from etl.serializers import dumps, elastic_serializers
+
+# Запуск из корня репозитория: python -m dump.dump_es
+DUMP_FILE = os.path.join(os.path.dirname(__file__), "dumped_data.json")
+
 
 # Elasticsearch connection
 async def dump_from_elasticsearch(index_name: str, output_file: str):
@@ -10,7 +15,7 @@ async def dump_from_elasticsearch(index_name: str, output_file: str):
     elastic_url = "http://localhost:9200"  # or use 'http://0.0.0.0:9200' if appropriate
 
     # Initialize Elasticsearch client
-    elastic = AsyncElasticsearch(hosts=[elastic_url])
+    elastic = AsyncElasticsearch(hosts=[elastic_url], serializers=elastic_serializers())
 
     # Initialize an empty list to store documents
     documents = []
@@ -33,8 +38,8 @@ async def dump_from_elasticsearch(index_name: str, output_file: str):
     await elastic.close()
 
     # Write the collected documents to a JSON file
-    with open(output_file, "w") as f:
-        json.dump(documents, f, indent=4)
+    with open(output_file, "wb") as f:
+        f.write(dumps(documents))
 
     print(f"Data from index '{index_name}' has been dumped to '{output_file}'")
 
@@ -42,7 +47,7 @@ async def dump_from_elasticsearch(index_name: str, output_file: str):
 # Run the dump function asynchronously
 async def main():
     # Specify the Elasticsearch index name and the output file name
-    await dump_from_elasticsearch("movies", "dumped_data.json")
+    await dump_from_elasticsearch("movies", DUMP_FILE)
 
 
 if __name__ == "__main__":
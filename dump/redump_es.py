@@ -1,8 +1,13 @@
 import asyncio
-import json
+import os
 
 from elasticsearch import AsyncElasticsearch, helpers
 
+from etl.serializers import elastic_serializers, loads
+
+# Запуск из корня репозитория: python -m dump.redump_es
+DUMP_FILE = os.path.join(os.path.dirname(__file__), "dumped_data.json")
+
 
 # Elasticsearch connection
 async def dump_to_elasticsearch(input_file: str, index_name: str):
@@ -10,11 +15,11 @@ async def dump_to_elasticsearch(input_file: str, index_name: str):
     elastic_url = "http://localhost:9200"  # Replace with your Elasticsearch URL
 
     # Initialize Elasticsearch client
-    elastic = AsyncElasticsearch(hosts=[elastic_url])
+    elastic = AsyncElasticsearch(hosts=[elastic_url], serializers=elastic_serializers())
 
     # Open the JSON file containing the dumped data
-    with open(input_file, "r") as f:
-        documents = json.load(f)
+    with open(input_file, "rb") as f:
+        documents = loads(f.read())
 
     # Prepare actions for bulk indexing
     actions = []
@@ -43,7 +48,7 @@ async def dump_to_elasticsearch(input_file: str, index_name: str):
 # Example usage
 async def main():
     # Specify the input JSON file and target Elasticsearch index
-    await dump_to_elasticsearch("dumped_data.json", "movies")
+    await dump_to_elasticsearch(DUMP_FILE, "movies")
 
 
 # Run the function asynchronously
@@ -0,0 +1,263 @@
+"""
+Микробенчмарки горячих участков ETL.
+
+Запуск из корня репозитория:
+
+    python -m etl.bench transform --rows 1000 --repeat 20
+    python -m etl.bench serialize --rows 10000 --repeat 5
+    python -m etl.bench explain --repeat 5
+    python -m etl.bench polling --rows 1000000 --repeat 5
+
+Бенчмарк explain выполняет EXPLAIN ANALYZE запросов выгрузки фильмов
+на базе из .env; для сравнения на реальных данных загрузите дамп
+movies_admin.sql (psql -f movies_admin.sql).
+
+Бенчмарк polling добавляет --rows синтетических фильмов в транзакции,
+которая затем откатывается, и сравнивает план запроса опроса изменений
+с индексом (modified, id) и без него. На время работы таблица film_work
+заблокирована, поэтому запускать его на рабочей базе не стоит.
+"""
+
+import argparse
+import datetime
+import uuid
+from timeit import repeat
+from typing import Callable, Dict, List
+
+import psycopg
+from elasticsearch.serializer import NdjsonSerializer
+from psycopg import sql
+from pydantic import TypeAdapter
+
+from etl.data_transform import DataTransform, movie_document
+from etl.db_extractions import MIN_UUID, MOVIES_QUERY, updated_objects_query
+from etl.serializers import FastNdjsonSerializer, orjson
+from etl.settings import Movie, Settings
+
+# Запрос выгрузки до перехода на LATERAL-подзапросы, для сравнения.
+LEGACY_MOVIES_QUERY = """
+SELECT
+    fw.id,
+    fw.title,
+    fw.description,
+    fw.rating AS imdb_rating,
+    fw.modified,
+    COALESCE(array_agg(DISTINCT g.name), '{{}}') AS genres,
+    COALESCE(array_agg(DISTINCT p.full_name) FILTER (WHERE pfw.role='director'), '{{}}') AS directors_names,
+    COALESCE(array_agg(DISTINCT p.full_name) FILTER (WHERE pfw.role='actor'), '{{}}') AS actors_names,
+    COALESCE(array_agg(DISTINCT p.full_name) FILTER (WHERE pfw.role='writer'), '{{}}') AS writers_names,
+    COALESCE(
+        json_agg(
+            DISTINCT jsonb_build_object(
+                'id', p.id,
+                'name', p.full_name
+            )
+        ) FILTER (WHERE pfw.role='director'),
+        '[]'
+    ) AS directors,
+    COALESCE(
+        json_agg(
+            DISTINCT jsonb_build_object(
+                'id', p.id,
+                'name', p.full_name
+            )
+        ) FILTER (WHERE pfw.role='actor'),
+        '[]'
+    ) AS actors,
+    COALESCE(
+        json_agg(
+            DISTINCT jsonb_build_object(
+                'id', p.id,
+                'name', p.full_name
+            )
+        ) FILTER (WHERE pfw.role='writer'),
+        '[]'
+    ) AS writers
+FROM content.film_work fw
+LEFT JOIN content.person_film_work pfw ON pfw.film_work_id = fw.id
+LEFT JOIN content.person p ON p.id = pfw.person_id
+LEFT JOIN content.genre_film_work gfw ON gfw.film_work_id = fw.id
+LEFT JOIN content.genre g ON g.id = gfw.genre_id
+{where}
+GROUP BY fw.id
+{order}
+"""
+
+
+def make_rows(count: int) -> List[dict]:
+    """Синтетические строки в формате результата MOVIES_QUERY."""
+    rows = []
+    for i in range(count):
+        persons = [
+            {"id": str(uuid.uuid4()), "name": f"Person {i}-{j}"} for j in range(8)
+        ]
+        rows.append(
+            {
+                "id": uuid.uuid4(),
+                "title": f"Movie {i}",
+                "description": "Lorem ipsum dolor sit amet " * 8,
+                "imdb_rating": 7.5,
+                "modified": datetime.datetime.now(datetime.timezone.utc),
+                "genres": ["Action", "Drama", "Sci-Fi"],
+                "directors_names": [p["name"] for p in persons[:1]],
+                "actors_names": [p["name"] for p in persons[1:6]],
+                "writers_names": [p["name"] for p in persons[6:]],
+                "directors": persons[:1],
+                "actors": persons[1:6],
+                "writers": persons[6:],
+            }
+        )
+    return rows
+
+
+def transform_per_row(rows: List[dict]) -> List[dict]:
+    """Прежний путь: проверка каждой строки отдельно и обход модели."""
+    adapter = TypeAdapter(Movie)
+    return [
+        {
+            "_op_type": "index",
+            "_index": "movies",
+            "_id": movie.id,
+            "_source": movie_document(movie.model_dump()),
+        }
+        for movie in (adapter.validate_python(row) for row in rows)
+    ]
+
+
+def report(title: str, cases: Dict[str, Callable[[], object]], rows: int, number: int):
+    print(title)
+    for name, case in cases.items():
+        best = min(repeat(case, number=1, repeat=number))
+        print(f"  {name:<24} {best * 1000 * 1000 / rows:10.3f} ms / 1k rows")
+
+
+def bench_transform(rows: int, number: int) -> None:
+    data = make_rows(rows)
+    validated = DataTransform(Movie)
+    trusted = DataTransform(Movie, validate=False)
+    report(
+        "DataTransform.transform_fw_data",
+        {
+            "per-row validation": lambda: transform_per_row(data),
+            "batch validation": lambda: validated.transform_fw_data(data),
+            "trusted rows": lambda: trusted.transform_fw_data(data),
+        },
+        rows,
+        number,
+    )
+
+
+def bench_serialize(rows: int, number: int) -> None:
+    actions = DataTransform(Movie, validate=False).transform_fw_data(make_rows(rows))
+    # Тело _bulk в том виде, в котором его кодирует клиент Elasticsearch.
+    lines = []
+    for action in actions:
+        lines.append({"index": {"_index": action["_index"], "_id": action["_id"]}})
+        lines.append(action["_source"])
+    stdlib, fast = NdjsonSerializer(), FastNdjsonSerializer()
+    size = len(stdlib.dumps(lines))
+    print(f"Bulk payload: {rows} documents, {size / 2**20:.1f} MiB")
+    report(
+        "NDJSON encoding",
+        {
+            "stdlib json": lambda: stdlib.dumps(lines),
+            "orjson" if orjson else "fallback (no orjson)": lambda: fast.dumps(lines),
+        },
+        rows,
+        number,
+    )
+
+
+def connect() -> psycopg.Connection:
+    config = Settings()
+    return psycopg.connect(
+        host=config.sql_host,
+        dbname=config.postgres_db,
+        user=config.postgres_user,
+        password=config.postgres_password,
+    )
+
+
+def explain(cursor, query, params=None) -> dict:
+    if isinstance(query, str):
+        query = sql.SQL(query)
+    cursor.execute(
+        sql.SQL("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {}").format(query), params
+    )
+    return cursor.fetchone()[0][0]
+
+
+def plan_nodes(plan: dict) -> List[str]:
+    """Типы узлов плана сверху вниз, например ['Limit', 'Index Scan']."""
+    nodes = [plan["Node Type"]]
+    for child in plan.get("Plans", []):
+        nodes.extend(plan_nodes(child))
+    return nodes
+
+
+def bench_explain(rows: int, number: int) -> None:
+    queries = {
+        "single GROUP BY": LEGACY_MOVIES_QUERY,
+        "LATERAL subqueries": MOVIES_QUERY,
+    }
+    with connect() as conn, conn.cursor() as cursor:
+        print("EXPLAIN ANALYZE of the film work export query")
+        for name, query in queries.items():
+            query = query.format(where="", order="ORDER BY fw.modified, fw.id")
+            plans = [explain(cursor, query) for _ in range(number)]
+            best = min(plans, key=lambda plan: plan["Execution Time"])
+            print(
+                f"  {name:<24} {best['Execution Time']:10.3f} ms, "
+                f"{best['Plan']['Actual Rows']} rows, "
+                f"{best['Plan'].get('Shared Hit Blocks', 0)} shared hits"
+            )
+
+
+def bench_polling(rows: int, number: int) -> None:
+    query = updated_objects_query("film_work")
+    since = datetime.datetime.min.replace(tzinfo=datetime.timezone.utc)
+    params = (since, MIN_UUID, 100)
+    with connect() as conn, conn.cursor() as cursor:
+        # Триггеры уведомлений ETL не нужны для синтетических строк.
+        cursor.execute("ALTER TABLE content.film_work DISABLE TRIGGER USER;")
+        cursor.execute(
+            """
+            INSERT INTO content.film_work (
+                id, title, description, creation_date, rating, type, created,
+                modified
+            )
+            SELECT gen_random_uuid(), 'Movie ' || n, '', ts, 0, 'movie', ts, ts
+            FROM generate_series(1, %s) AS n,
+                LATERAL (SELECT now() - make_interval(secs => n / 10)) AS t(ts);
+            """,
+            (rows,),
+        )
+        cursor.execute("ANALYZE content.film_work;")
+        print(f"Polling query plan with {rows} extra film works")
+        for name, index_scans in (("with index", "on"), ("without index", "off")):
+            cursor.execute(f"SET LOCAL enable_indexscan = {index_scans};")
+            cursor.execute(f"SET LOCAL enable_bitmapscan = {index_scans};")
+            plans = [explain(cursor, query, params) for _ in range(number)]
+            best = min(plans, key=lambda plan: plan["Execution Time"])
+            print(
+                f"  {name:<24} {best['Execution Time']:10.3f} ms, "
+                f"{' -> '.join(plan_nodes(best['Plan']))}"
+            )
+        conn.rollback()
+
+
+BENCHMARKS = {
+    "explain": bench_explain,
+    "polling": bench_polling,
+    "serialize": bench_serialize,
+    "transform": bench_transform,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args.rows, args.repeat)
@@ -1,125 +1,66 @@
 import logging
-from typing import List, Type
+from typing import List, Optional, Type
+from uuid import UUID
 
 from pydantic import BaseModel, TypeAdapter
 
 logger = logging.getLogger(__name__)
 
 
+def _person_list(persons: Optional[List[dict]]) -> Optional[List[dict]]:
+    return [{"id": p["id"], "name": p["name"]} for p in persons] if persons else None
+
+
+def movie_document(movie: dict) -> dict:
+    """Документ фильма для индекса movies из строки запроса MOVIES_QUERY."""
+    return {
+        "id": movie["id"],
+        "title": movie["title"],
+        "description": movie["description"],
+        "imdb_rating": movie["imdb_rating"],
+        "genres": movie["genres"],
+        "directors_names": movie["directors_names"],
+        "actors_names": movie["actors_names"],
+        "writers_names": movie["writers_names"],
+        "directors": _person_list(movie["directors"]),
+        "actors": _person_list(movie["actors"]),
+        "writers": _person_list(movie["writers"]),
+    }
+
+
 class DataTransform:
-    def __init__(self, model: Type[BaseModel]):
+    def __init__(self, model: Type[BaseModel], validate: bool = True):
+        """
+        :param validate: Проверять строки моделью. Без проверки документы
+            строятся прямо из строк SQL-запроса, которым можно доверять.
+        """
         self.data_model = model
-        self.type_adapter = TypeAdapter(model)
+        self.validate = validate
+        self.type_adapter = TypeAdapter(List[model])
 
-    def transform_fw_data(self, data: List[dict]) -> List[dict] or None:
-        bulk_data = []
-        fw_objects = [self.type_adapter.validate_python(movie) for movie in data]
-        for movie in fw_objects:
-            action = {
+    def transform_fw_data(
+        self, data: List[dict], index_name: str = "movies"
+    ) -> List[dict] or None:
+        if self.validate:
+            # Вся пачка проверяется одним вызовом pydantic-core, а документы
+            # строятся из исходных строк без повторного обхода моделей.
+            self.type_adapter.validate_python(data)
+        bulk_data = [
+            {
                 "_op_type": "index",
-                "_index": "movies",
-                "_id": movie.id,
-                "_source": {
-                    "title": movie.title,
-                    "description": movie.description,
-                    "imdb_rating": movie.imdb_rating,
-                    "genres": movie.genres,
-                    "directors_names": movie.directors_names,
-                    "actors_names": movie.actors_names,
-                    "writers_names": movie.writers_names,
-                    "directors": (
-                        [
-                            {"id": director.id, "name": director.name}
-                            for director in movie.directors
-                        ]
-                        if movie.directors
-                        else None
-                    ),
-                    "actors": (
-                        [{"id": actor.id, "name": actor.name} for actor in movie.actors]
-                        if movie.actors
-                        else None
-                    ),
-                    "writers": (
-                        [
-                            {"id": writer.id, "name": writer.name}
-                            for writer in movie.writers
-                        ]
-                        if movie.writers
-                        else None
-                    ),
-                },
+                "_index": index_name,
+                "_id": movie["id"],
+                "_source": movie_document(movie),
             }
-            bulk_data.append(action)
+            for movie in data
+        ]
         logger.info(f"Transforming {len(bulk_data)} movies to Elasticsearch...")
         return bulk_data
 
-    def transform_updates_fw(self, data: List[dict]) -> List[dict] or None:
-        bulk_data = []
-        fw_objects = [self.type_adapter.validate_python(movie) for movie in data]
-        for movie in fw_objects:
-            action = {
-                "_op_type": "update",
-                "_index": "movies",
-                "_id": movie.id,
-                "doc": {
-                    "title": movie.title,
-                    "description": movie.description,
-                    "imdb_rating": movie.imdb_rating,
-                },
-            }
-            bulk_data.append(action)
-        return bulk_data
-
-    def transform_genres_updates(self, movies: List[dict]) -> List[dict] or None:
-        bulk_data = []
-        fw_objects = [self.type_adapter.validate_python(movie) for movie in movies]
-        for movie in fw_objects:
-            action = {
-                "_op_type": "update",
-                "_index": "movies",
-                "_id": movie.id,
-                "doc": {
-                    "genres": movie.genres,
-                },
-            }
-            bulk_data.append(action)
-        return bulk_data
-
-    def transform_persons_updates(self, movies: List[dict]) -> List[dict] or None:
-        bulk_data = []
-        fw_objects = [self.type_adapter.validate_python(movie) for movie in movies]
-        for movie in fw_objects:
-            action = {
-                "_op_type": "update",
-                "_index": "movies",
-                "_id": movie.id,
-                "doc": {
-                    "directors_names": movie.directors_names,
-                    "actors_names": movie.actors_names,
-                    "writers_names": movie.writers_names,
-                    "directors": (
-                        [
-                            {"id": director.id, "name": director.name}
-                            for director in movie.directors
-                        ]
-                        if movie.directors
-                        else None
-                    ),
-                    "actors": (
-                        [{"id": actor.id, "name": actor.name} for actor in movie.actors]
-                        if movie.actors
-                        else None
-                    ),
-                    "writers": (
-                        [
-                            {"id": writer.id, "name": writer.name}
-                            for writer in movie.writers
-                        ]
-                        if movie.writers
-                        else None
-                    ),
-                },
-            }
-            bulk_data.append(action)
-        return bulk_data
+    def transform_deleted(
+        self, fw_ids: List[UUID], index_name: str = "movies"
+    ) -> List[dict]:
+        return [
+            {"_op_type": "delete", "_index": index_name, "_id": fw_id}
+            for fw_id in fw_ids
+        ]
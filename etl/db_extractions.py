@@ -1,21 +1,154 @@
 import datetime
 import logging
 from contextlib import closing
-from typing import Any, Dict, List, Literal
+from typing import Any, Dict, Iterator, List, Literal, Optional, Sequence, Tuple
+from uuid import UUID
 
 import psycopg
+from psycopg import sql
+from psycopg.adapt import Loader
 from psycopg.rows import dict_row
 
-from etl.settings import Movie, Settings
+from etl.settings import Settings
 from etl.state import State
 
 logger = logging.getLogger(__name__)
 
+# Жанры и персоны агрегируются в отдельных LATERAL-подзапросах по id фильма:
+# при общем GROUP BY соединение персон с жанрами давало произведение
+# persons x genres строк на фильм, которое затем схлопывалось DISTINCT.
+MOVIES_QUERY = """
+SELECT
+    fw.id,
+    fw.title,
+    fw.description,
+    fw.rating AS imdb_rating,
+    fw.modified,
+    COALESCE(g.genres, '{{}}') AS genres,
+    COALESCE(p.directors_names, '{{}}') AS directors_names,
+    COALESCE(p.actors_names, '{{}}') AS actors_names,
+    COALESCE(p.writers_names, '{{}}') AS writers_names,
+    COALESCE(p.directors, '[]') AS directors,
+    COALESCE(p.actors, '[]') AS actors,
+    COALESCE(p.writers, '[]') AS writers
+FROM content.film_work fw
+CROSS JOIN LATERAL (
+    SELECT array_agg(DISTINCT g.name) AS genres
+    FROM content.genre_film_work gfw
+    JOIN content.genre g ON g.id = gfw.genre_id
+    WHERE gfw.film_work_id = fw.id
+) g
+CROSS JOIN LATERAL (
+    SELECT
+        array_agg(DISTINCT p.full_name) FILTER (WHERE pfw.role = 'director') AS directors_names,
+        array_agg(DISTINCT p.full_name) FILTER (WHERE pfw.role = 'actor') AS actors_names,
+        array_agg(DISTINCT p.full_name) FILTER (WHERE pfw.role = 'writer') AS writers_names,
+        json_agg(DISTINCT jsonb_build_object('id', p.id, 'name', p.full_name))
+            FILTER (WHERE pfw.role = 'director') AS directors,
+        json_agg(DISTINCT jsonb_build_object('id', p.id, 'name', p.full_name))
+            FILTER (WHERE pfw.role = 'actor') AS actors,
+        json_agg(DISTINCT jsonb_build_object('id', p.id, 'name', p.full_name))
+            FILTER (WHERE pfw.role = 'writer') AS writers
+    FROM content.person_film_work pfw
+    JOIN content.person p ON p.id = pfw.person_id
+    WHERE pfw.film_work_id = fw.id
+) p
+{where}
+{order}
+"""
+
+# Готовые строки NDJSON для _bulk: действие и _source документа в jsonb.
+MOVIE_DOCUMENTS_QUERY = """
+SELECT
+    m.id,
+    m.modified,
+    jsonb_build_object('index', jsonb_build_object('_index', %s::text, '_id', m.id)) AS action,
+    jsonb_build_object(
+        'id', m.id,
+        'title', m.title,
+        'description', m.description,
+        'imdb_rating', m.imdb_rating,
+        'genres', m.genres,
+        'directors_names', m.directors_names,
+        'actors_names', m.actors_names,
+        'writers_names', m.writers_names,
+        'directors', NULLIF(m.directors::jsonb, '[]'),
+        'actors', NULLIF(m.actors::jsonb, '[]'),
+        'writers', NULLIF(m.writers::jsonb, '[]')
+    ) AS source
+FROM ({movies}) m
+{order}
+"""
+
+# Время в позиции keyset-курсора полной загрузки для фильмов без modified:
+# курсор идёт по (coalesce(modified, NULL_MODIFIED), id), такие фильмы
+# выгружаются первыми.
+NULL_MODIFIED = datetime.datetime.min.replace(tzinfo=datetime.timezone.utc)
+FULL_LOAD_KEY = "coalesce({alias}.modified, %s), {alias}.id"
+
+# Таблица -> (колонка, по которой находится фильм или объект, колонка времени изменения).
+CHANGE_COLUMNS = {
+    "film_work": ("id", "modified"),
+    "genre": ("id", "modified"),
+    "person": ("id", "modified"),
+    "genre_film_work": ("film_work_id", "created"),
+    "person_film_work": ("film_work_id", "created"),
+}
+
+# Номер шарда фильма: остаток от деления младших 28 бит идентификатора.
+SHARD_PREDICATE = "mod(('x' || right({column}::text, 7))::bit(28)::int, %s) = %s"
+
+
+# Keyset-курсор по (время изменения, id строки): строки с одинаковым
+# временем на границе пачки не теряются, в отличие от условия time > since.
+UPDATED_OBJECTS_QUERY = """
+SELECT {id_column}, {time_column}, id
+FROM {table}
+WHERE ({time_column}, id) > (%s, %s::uuid)
+ORDER BY {time_column}, id
+LIMIT %s
+"""
+
+MIN_UUID = "00000000-0000-0000-0000-000000000000"
+
+
+def updated_objects_query(
+    table: str, id_column: str = "id", time_column: str = "modified"
+) -> sql.Composed:
+    """Запрос пачки строк таблицы схемы content, изменённых после отметки."""
+    return sql.SQL(UPDATED_OBJECTS_QUERY).format(
+        id_column=sql.Identifier(id_column),
+        time_column=sql.Identifier(time_column),
+        table=sql.Identifier("content", table),
+    )
+
+
+class RawJsonLoader(Loader):
+    """Отдаёт json и jsonb байтами, без разбора в объекты Python."""
+
+    def load(self, data) -> bytes:
+        return bytes(data)
+
+
+def shard_of(fw_id: Any, shard_count: int) -> int:
+    """Номер шарда фильма, согласованный с SHARD_PREDICATE."""
+    return int(str(fw_id)[-7:], 16) % shard_count
+
 
 class DBExtractions:
-    def __init__(self, config: Settings, state: State):
+    def __init__(
+        self,
+        config: Settings,
+        state: State,
+        shard: Optional[Tuple[int, int]] = None,
+    ):
+        """
+        :param shard: Пара (номер шарда, количество шардов); если задана,
+            выгружаются только фильмы этого шарда.
+        """
         self.state: State = state
         self.config = config
+        self.shard = shard
 
         try:
             conn = psycopg.connect(
@@ -30,184 +163,232 @@ class DBExtractions:
             logger.error("Error connecting to PostgreSQL: %s" % str(e))
             raise
 
-    def extract_data(self) -> List[Dict[str, Any]]:
-        query = """
-        SELECT
-            fw.id,
-            fw.title,
-            fw.description,
-            fw.rating AS imdb_rating,
-            fw.modified,
-            COALESCE(array_agg(DISTINCT g.name), '{}') AS genres,
-            COALESCE(array_agg(DISTINCT p.full_name) FILTER (WHERE pfw.role='director'), '{}') AS directors_names,
-            COALESCE(array_agg(DISTINCT p.full_name) FILTER (WHERE pfw.role='actor'), '{}') AS actors_names,
-            COALESCE(array_agg(DISTINCT p.full_name) FILTER (WHERE pfw.role='writer'), '{}') AS writers_names,
-            COALESCE(
-                json_agg(
-                    DISTINCT jsonb_build_object(
-                        'id', p.id,
-                        'name', p.full_name
-                    )
-                ) FILTER (WHERE pfw.role='director'),
-                '[]'
-            ) AS directors,
-            COALESCE(
-                json_agg(
-                    DISTINCT jsonb_build_object(
-                        'id', p.id,
-                        'name', p.full_name
-                    )
-                ) FILTER (WHERE pfw.role='actor'),
-                '[]'
-            ) AS actors,
-            COALESCE(
-                json_agg(
-                    DISTINCT jsonb_build_object(
-                        'id', p.id,
-                        'name', p.full_name
-                    )
-                ) FILTER (WHERE pfw.role='writer'),
-                '[]'
-            ) AS writers
-        FROM content.film_work fw
-        LEFT JOIN content.person_film_work pfw ON pfw.film_work_id = fw.id
-        LEFT JOIN content.person p ON p.id = pfw.person_id
-        LEFT JOIN content.genre_film_work gfw ON gfw.film_work_id = fw.id
-        LEFT JOIN content.genre g ON g.id = gfw.genre_id
-        GROUP BY fw.id;
-        """
-        with self.conn.cursor(row_factory=dict_row) as cursor:
-            cursor.execute(query)
-            rows = cursor.fetchall()
-            data = []
-            for row in rows:
-                movie = Movie(
-                    id=row["id"],
-                    title=row["title"],
-                    description=row.get("description"),
-                    imdb_rating=row.get("imdb_rating"),
-                    genres=row["genres"],
-                    directors_names=row["directors_names"],
-                    actors_names=row["actors_names"],
-                    writers_names=row["writers_names"],
-                    directors=row["directors"],
-                    actors=row["actors"],
-                    writers=row["writers"],
-                    modified=row["modified"],
-                )
-                data.append(movie.model_dump())
-            data.sort(key=lambda x: x["modified"])
-        return data
+    def owns(self, fw_id: Any) -> bool:
+        """Принадлежит ли фильм шарду этого экземпляра."""
+        if self.shard is None:
+            return True
+        index, count = self.shard
+        return shard_of(fw_id, count) == index
+
+    def _shard_condition(self, column: str) -> tuple[list, tuple]:
+        """Условие WHERE и параметры, ограничивающие выборку шардом."""
+        if self.shard is None:
+            return [], ()
+        index, count = self.shard
+        return [SHARD_PREDICATE.format(column=column)], (count, index)
+
+    def extract_data(
+        self,
+        batch_size: int,
+        after: Optional[Sequence[str]] = None,
+        index_name: Optional[str] = None,
+    ) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Потоково выгружает фильмы из PostgreSQL пачками по batch_size строк.
+
+        Используется именованный (серверный) курсор, поэтому в памяти
+        одновременно находится не больше одной пачки. Сортировка по
+        (modified, id) выполняется на стороне базы, что позволяет
+        продолжить выгрузку с сохранённой позиции keyset-курсора. Фильмы
+        без modified идут первыми с временем NULL_MODIFIED в позиции.
+
+        :param batch_size: Размер пачки.
+        :param after: Позиция курсора (modified, id), после которой продолжить.
+        :param index_name: Если задан, вместо полей фильма выгружаются готовые
+            строки bulk-запроса в этот индекс (см. MOVIE_DOCUMENTS_QUERY).
+        :return: Итератор по пачкам строк.
+        """
+        conditions, params = self._shard_condition("fw.id")
+        if after:
+            modified, fw_id = after
+            conditions.append(f"({FULL_LOAD_KEY.format(alias='fw')}) > (%s, %s::uuid)")
+            params += (
+                NULL_MODIFIED,
+                datetime.datetime.fromisoformat(modified),
+                fw_id,
+            )
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        if index_name is None:
+            query = MOVIES_QUERY.format(
+                where=where, order=f"ORDER BY {FULL_LOAD_KEY.format(alias='fw')}"
+            )
+        else:
+            query = MOVIE_DOCUMENTS_QUERY.format(
+                movies=MOVIES_QUERY.format(where=where, order=""),
+                order=f"ORDER BY {FULL_LOAD_KEY.format(alias='m')}",
+            )
+            params = (index_name, *params)
+        params += (NULL_MODIFIED,)
+
+        with self.conn.cursor(
+            name="film_work_full_load", row_factory=dict_row
+        ) as cursor:
+            if index_name is not None:
+                cursor.adapters.register_loader("jsonb", RawJsonLoader)
+            cursor.itersize = batch_size
+            cursor.execute(query, params)
+            while rows := cursor.fetchmany(batch_size):
+                yield rows
+        self.conn.commit()
+
+    def iter_film_work_ids(self, batch_size: int) -> Iterator[str]:
+        """Выдаёт идентификаторы фильмов в порядке возрастания серверным курсором."""
+        conditions, params = self._shard_condition("id")
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self.conn.cursor(name="film_work_ids") as cursor:
+            cursor.itersize = batch_size
+            cursor.execute(
+                f"SELECT id FROM content.film_work {where} ORDER BY id;", params
+            )
+            for (fw_id,) in cursor:
+                yield str(fw_id)
+        self.conn.commit()
+
+    def count_film_works(self) -> int:
+        """Возвращает количество фильмов в PostgreSQL."""
+        with closing(self.conn.cursor()) as psql_cursor:
+            psql_cursor.execute("SELECT count(*) FROM content.film_work;")
+            return psql_cursor.fetchone()[0]
+
+    def extract_movies_by_ids(
+        self, fw_ids: List[UUID], index_name: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Собирает полные документы фильмов по их идентификаторам.
+
+        :param fw_ids: Идентификаторы фильмов.
+        :param index_name: Если задан, выгружаются готовые строки bulk-запроса.
+        :return: Строки фильмов в формате полной загрузки.
+        """
+        query = MOVIES_QUERY.format(where="WHERE fw.id = ANY(%s::uuid[])", order="")
+        params = (fw_ids,)
+        if index_name is not None:
+            query = MOVIE_DOCUMENTS_QUERY.format(movies=query, order="")
+            params = (index_name, fw_ids)
+        with self.conn.cursor(row_factory=dict_row) as psql_cursor:
+            if index_name is not None:
+                psql_cursor.adapters.register_loader("jsonb", RawJsonLoader)
+            psql_cursor.execute(query, params, prepare=True)
+            return psql_cursor.fetchall()
 
     def get_updated_objects_ids(
-        self, table: Literal["person", "genre"], key_state: str
-    ) -> tuple[list, datetime.datetime] or None:
+        self,
+        table: str,
+        since: Any,
+        id_column: str = "id",
+        time_column: str = "modified",
+    ) -> tuple[list, list] or None:
+        """
+        Возвращает пачку объектов таблицы, изменённых после позиции since.
+
+        Запрос параметризован и выполняется как подготовленный
+        (prepared statement), поэтому циклы опроса переиспользуют план.
+
+        :param table: Таблица схемы content.
+        :param since: Позиция курсора [время ISO 8601, id строки]; строка
+            только со временем продолжает с первой строки этого времени,
+            None — выборка с начала.
+        :return: Идентификаторы и позиция курсора после последней строки пачки.
+        """
+        if since is None:
+            since = datetime.datetime.min.replace(tzinfo=datetime.timezone.utc)
+        if not isinstance(since, (list, tuple)):
+            since = (since, MIN_UUID)
+        time, row_id = since
+        if isinstance(time, str):
+            time = datetime.datetime.fromisoformat(time)
+        query = updated_objects_query(table, id_column, time_column)
         with closing(self.conn.cursor()) as psql_cursor:
-            time = self.state.get_state(key_state)
-            if time is None:
-                time = datetime.datetime.min
-            query = f"""
-            SELECT id, modified
-            FROM content.{table}
-            WHERE modified > '{time}'
-            ORDER BY modified
-            LIMIT '{self.config.batch_size}';
-            """
-            psql_cursor.execute(query)
+            psql_cursor.execute(
+                query, (time, row_id, self.config.batch_size), prepare=True
+            )
             results = psql_cursor.fetchall()
-            if results:
-                time = results[-1][1]
-                ids = list(i[0] for i in results)
-                return ids, time
-            else:
-                return None
+        if not results:
+            return None
+        _, last_time, last_id = results[-1]
+        return [row[0] for row in results], [last_time.isoformat(), str(last_id)]
 
-    def get_updated_fw(self, state_key: str) -> tuple[list, datetime.datetime] or None:
-        with self.conn.cursor(row_factory=dict_row) as psql_cursor:
-            time = self.state.get_state(state_key)
-            if time is None:
-                time = datetime.datetime.min
-            query = f"""
-            SELECT
-                fw.id,
-                fw.title,
-                fw.description,
-                fw.rating AS imdb_rating,
-                fw.modified
-            FROM content.film_work fw
-            WHERE fw.modified > '{time}'
-            ORDER BY fw.modified
-            LIMIT '{self.config.batch_size}';
-            """
-            psql_cursor.execute(query)
-
-            rows = psql_cursor.fetchall()
-            if rows:
-                last_update_time = rows[-1]["modified"]
-                return rows, last_update_time
-            else:
+    def get_changed_film_work_ids(
+        self, table: str, since: Any
+    ) -> tuple[list, list] or None:
+        """
+        Возвращает идентификаторы фильмов, затронутых изменениями в таблице.
+
+        Для жанров и персон изменённые объекты сопоставляются фильмам
+        через таблицы связей.
+
+        :param table: Таблица-источник изменений.
+        :param since: Позиция курсора (см. get_updated_objects_ids).
+        :return: Идентификаторы фильмов и позиция курсора после пачки.
+        """
+        id_column, time_column = CHANGE_COLUMNS[table]
+        updated = self.get_updated_objects_ids(table, since, id_column, time_column)
+        if updated is None:
+            return None
+        ids, position = updated
+        if table in ("genre", "person"):
+            ids = self.get_film_work_ids(table, ids)
+        return ids, position
+
+    def get_film_work_ids(
+        self, table: Literal["person", "genre"], object_ids: List[UUID]
+    ) -> List[UUID]:
+        """Возвращает фильмы, связанные с жанрами или персонами."""
+        query = sql.SQL("""
+            SELECT DISTINCT film_work_id
+            FROM {link_table}
+            WHERE {object_column} = ANY(%s::uuid[]);
+            """).format(
+            link_table=sql.Identifier("content", f"{table}_film_work"),
+            object_column=sql.Identifier(f"{table}_id"),
+        )
+        with closing(self.conn.cursor()) as psql_cursor:
+            psql_cursor.execute(query, (object_ids,), prepare=True)
+            return [row[0] for row in psql_cursor.fetchall()]
+
+    def get_logged_changes(self, since_id: int) -> tuple[list, int] or None:
+        """
+        Читает пачку записей журнала изменений связей фильмов.
+
+        Журнал content.etl_change_log заполняется триггерами на удаление
+        и изменение строк genre_film_work и person_film_work.
+
+        :param since_id: Идентификатор последней обработанной записи.
+        :return: Идентификаторы фильмов и последний идентификатор в пачке.
+        """
+        query = """
+        SELECT film_work_id, id
+        FROM content.etl_change_log
+        WHERE id > %s
+        ORDER BY id
+        LIMIT %s;
+        """
+        with closing(self.conn.cursor()) as psql_cursor:
+            psql_cursor.execute(query, (since_id, self.config.batch_size), prepare=True)
+            results = psql_cursor.fetchall()
+            if not results:
                 return None
+            return [row[0] for row in results], results[-1][1]
 
-    def updates_genres(self, updated_ids):
-        str_updated_ids = ", ".join([f"'{uuid}'" for uuid in updated_ids])
-        logger.info(f"Updating Genres : %s", len(updated_ids))
-        query = f"""
-        SELECT
-            fw.id,
-            COALESCE(array_agg(DISTINCT g.name), '{{}}') AS genres
-        FROM content.film_work fw
-        LEFT JOIN content.genre_film_work gfw ON gfw.film_work_id = fw.id
-        LEFT JOIN content.genre g ON g.id = gfw.genre_id
-        WHERE g.id IN ({str_updated_ids})
-        GROUP BY fw.id
+    def prune_change_log(self, consumed_id: int, retention_days: int) -> None:
         """
-        with self.conn.cursor(row_factory=dict_row) as psql_cursor:
-            psql_cursor.execute(query)
-            rows = psql_cursor.fetchall()
-            return rows
+        Удаляет обработанные записи журнала изменений старше retention_days дней.
+
+        Записи после consumed_id остаются, сколько бы ETL ни простаивал.
+        Шард удаляет только записи своих фильмов: записи остальных фильмов
+        обрабатываются другими шардами со своими отметками.
 
-    def update_persons(self, updated_ids):
-        str_updated_ids = ", ".join([f"'{uuid}'" for uuid in updated_ids])
+        :param consumed_id: Идентификатор последней обработанной записи.
+        """
+        conditions, params = self._shard_condition("film_work_id")
+        conditions += [
+            "id <= %s",
+            "changed_at < now() - make_interval(days => %s)",
+        ]
         query = f"""
-                SELECT
-                    fw.id,
-                    COALESCE(array_agg(DISTINCT p.full_name) FILTER (WHERE pfw.role='director'), '{{}}') AS directors_names,
-                    COALESCE(array_agg(DISTINCT p.full_name) FILTER (WHERE pfw.role='actor'), '{{}}') AS actors_names,
-                    COALESCE(array_agg(DISTINCT p.full_name) FILTER (WHERE pfw.role='writer'), '{{}}') AS writers_names,
-                    COALESCE(
-                        json_agg(
-                            DISTINCT jsonb_build_object(
-                                'id', p.id,
-                                'name', p.full_name
-                            )
-                        ) FILTER (WHERE pfw.role='director'),
-                        '[]'
-                    ) AS directors,
-                    COALESCE(
-                        json_agg(
-                            DISTINCT jsonb_build_object(
-                                'id', p.id,
-                                'name', p.full_name
-                            )
-                        ) FILTER (WHERE pfw.role='actor'),
-                        '[]'
-                    ) AS actors,
-                    COALESCE(
-                        json_agg(
-                            DISTINCT jsonb_build_object(
-                                'id', p.id,
-                                'name', p.full_name
-                            )
-                        ) FILTER (WHERE pfw.role='writer'),
-                        '[]'
-                    ) AS writers
-                FROM content.film_work fw
-                LEFT JOIN content.person_film_work pfw ON pfw.film_work_id = fw.id
-                LEFT JOIN content.person p ON p.id = pfw.person_id
-                WHERE p.id IN ({str_updated_ids})
-                GROUP BY fw.id
-                """
-        with self.conn.cursor(row_factory=dict_row) as psql_cursor:
-            psql_cursor.execute(query)
-            rows = psql_cursor.fetchall()
-            return rows
+        DELETE FROM content.etl_change_log
+        WHERE {' AND '.join(conditions)};
+        """
+        with closing(self.conn.cursor()) as psql_cursor:
+            psql_cursor.execute(query, (*params, consumed_id, retention_days))
+        self.conn.commit()
@@ -1,25 +1,41 @@
 import logging
-from typing import Any, Dict, List, Type
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from time import sleep
+from typing import Any, Dict, Iterator, List, Type
 
 import backoff
-from elasticsearch import Elasticsearch, NotFoundError, RequestError
-from elasticsearch.helpers import bulk
+from elasticsearch import (
+    ApiError,
+    ConnectionError,
+    ConnectionTimeout,
+    Elasticsearch,
+    NotFoundError,
+)
+from elasticsearch.helpers import BulkIndexError, streaming_bulk
 from pydantic import BaseModel
 
-from etl.settings import Settings, type_map
+from etl.serializers import elastic_serializers
+from etl.settings import Settings, settings_hash, type_map
 from etl.state import State
 
 logger = logging.getLogger(__name__)
 
+# Настройки, которые отключает режим массовой загрузки, и их значения
+# по умолчанию в Elasticsearch, если они не заданы в теле индекса.
+INGEST_SETTINGS_DEFAULTS = {"refresh_interval": "1s", "number_of_replicas": 1}
+
 
 class ElasticSearchLoader:
     @backoff.on_exception(backoff.expo, Exception, max_tries=5, jitter=None)
     def __init__(self, config: Settings, state: State):
+        self.config = config
         self.state = state
         try:
             es = Elasticsearch(
                 config.es_host,
                 http_compress=True,
+                serializers=elastic_serializers(),
                 headers={"Content-Type": "application/x-ndjson"},
             )
             if es.ping():
@@ -32,56 +48,155 @@ class ElasticSearchLoader:
             logger.error("Error connecting to Elasticsearch: %s" % e)
             raise
 
-    @backoff.on_exception(backoff.expo, Exception, max_tries=5, jitter=None)
+    @backoff.on_exception(
+        backoff.expo, (ConnectionError, ConnectionTimeout), max_tries=5, jitter=None
+    )
+    def send_bulk(self, data: List[Dict[str, Any]]) -> None:
+        """
+        Отправляет bulk-действия в Elasticsearch без изменения состояния.
+
+        Действия разбиваются на чанки по bulk_chunk_size; при bulk_workers > 1
+        чанки отправляются параллельно. Ответы 429 повторяются с backoff
+        для каждого чанка отдельно.
+
+        :param data: Список bulk-действий для загрузки.
+        :return: None
+        """
+        logger.info("Loading %s records to Elasticsearch." % len(data))
+        chunk_size = self.config.bulk_chunk_size
+        if self.config.bulk_workers > 1 and len(data) > chunk_size:
+            chunks = [data[i : i + chunk_size] for i in range(0, len(data), chunk_size)]
+            with ThreadPoolExecutor(max_workers=self.config.bulk_workers) as executor:
+                success = sum(executor.map(self._send_chunks, chunks))
+        else:
+            success = self._send_chunks(data)
+        logger.info(f"Successfully loaded {success} documents in batch.")
+
+    def _send_chunks(self, data: List[Dict[str, Any]]) -> int:
+        """Отправляет действия последовательными чанками с повтором на 429."""
+        client = self.es.options(request_timeout=self.config.bulk_request_timeout)
+        success = 0
+        for ok, _ in streaming_bulk(
+            client,
+            data,
+            chunk_size=self.config.bulk_chunk_size,
+            max_chunk_bytes=self.config.bulk_max_chunk_bytes,
+            max_retries=self.config.bulk_max_retries,
+            initial_backoff=self.config.bulk_initial_backoff,
+            max_backoff=self.config.bulk_max_backoff,
+            # Удаление уже отсутствующего документа не считается ошибкой.
+            ignore_status=404,
+        ):
+            success += ok
+        return success
+
+    @backoff.on_exception(
+        backoff.expo, (ConnectionError, ConnectionTimeout), max_tries=5, jitter=None
+    )
+    def send_raw_bulk(self, rows: List[Dict[str, Any]]) -> None:
+        """
+        Отправляет в Elasticsearch строки, уже собранные в PostgreSQL.
+
+        Каждая строка содержит байты действия (action) и документа (source),
+        которые передаются в _bulk как есть, без разбора и повторной
+        сериализации. Чанки ограничены bulk_chunk_size и bulk_max_chunk_bytes.
+
+        :param rows: Строки с ключами action и source.
+        :return: None
+        """
+        logger.info("Loading %s records to Elasticsearch." % len(rows))
+        chunks = list(self._raw_chunks(rows))
+        if self.config.bulk_workers > 1 and len(chunks) > 1:
+            with ThreadPoolExecutor(max_workers=self.config.bulk_workers) as executor:
+                success = sum(executor.map(self._send_raw_chunk, chunks))
+        else:
+            success = sum(map(self._send_raw_chunk, chunks))
+        logger.info(f"Successfully loaded {success} documents in batch.")
+
+    def _raw_chunks(self, rows: List[Dict[str, Any]]) -> Iterator[List[Dict]]:
+        chunk, size = [], 0
+        for row in rows:
+            row_size = len(row["action"]) + len(row["source"]) + 2
+            if chunk and (
+                len(chunk) >= self.config.bulk_chunk_size
+                or size + row_size > self.config.bulk_max_chunk_bytes
+            ):
+                yield chunk
+                chunk, size = [], 0
+            chunk.append(row)
+            size += row_size
+        if chunk:
+            yield chunk
+
+    def _send_raw_chunk(self, rows: List[Dict[str, Any]]) -> int:
+        """
+        Отправляет чанк готовых строк, повторяя отклонённые с 429 документы.
+
+        Если с 429 отклонён весь запрос _bulk, чанк повторяется целиком
+        с той же задержкой.
+        """
+        client = self.es.options(request_timeout=self.config.bulk_request_timeout)
+        success = 0
+        for attempt in range(self.config.bulk_max_retries + 1):
+            if attempt:
+                sleep(
+                    min(
+                        self.config.bulk_max_backoff,
+                        self.config.bulk_initial_backoff * 2 ** (attempt - 1),
+                    )
+                )
+            operations = [
+                line for row in rows for line in (row["action"], row["source"])
+            ]
+            try:
+                response = client.bulk(operations=operations)
+            except ApiError as e:
+                if e.status_code != 429:
+                    raise
+                continue
+            if not response["errors"]:
+                return success + len(rows)
+            retry, errors = [], []
+            for row, item in zip(rows, response["items"]):
+                status = next(iter(item.values()))["status"]
+                if status == 429:
+                    retry.append(row)
+                elif status >= 300:
+                    errors.append(item)
+            if errors:
+                raise BulkIndexError(
+                    f"{len(errors)} document(s) failed to index.", errors
+                )
+            success += len(rows) - len(retry)
+            rows = retry
+        raise BulkIndexError(
+            f"{len(rows)} document(s) were rejected after retries.", rows
+        )
+
     def load_data_to_elasticsearch(
         self,
         data: List[Dict[str, Any]],
-        batch_size: int,
         state_key: str,
-        state_param: str,
+        checkpoint: Any,
+        raw: bool = False,
     ) -> None:
         """
-        Загружает данные в Elasticsearch с использованием bulk-запроса.
+        Загружает пачку данных в Elasticsearch с использованием bulk-запроса.
 
-        :param data: Список словарей с данными для загрузки.
-        :param batch_size: Размер пакета данных для загрузки.
+        Позиция курсора сохраняется в состоянии только после успешной
+        загрузки всей пачки, поэтому при сбое пачка будет загружена повторно.
+
+        :param data: Список bulk-действий для загрузки.
         :param state_key: Ключ состояния.
-        :param state_param Ключ по полю для поиска.
+        :param checkpoint: Позиция keyset-курсора после последней записи пачки.
+        :param raw: Данные — готовые строки bulk-запроса (см. send_raw_bulk).
         :return: None
         """
-        last_loaded = self.state.get_state(state_key)
-
-        try:
-            total = len(data)
-            logger.info("Loading %s records from Elasticsearch." % total)
-            start_index = 0
-            if last_loaded:
-                for i, item in enumerate(data):
-                    if item.get(state_param) == last_loaded:
-                        start_index = i + 1
-                        break
-            for i in range(start_index, total, batch_size):
-                batch = data[i : i + batch_size]
-                bulk_data = batch
-                try:
-                    success, failed = bulk(
-                        self.es,
-                        bulk_data,
-                        request_timeout=200,
-                        headers={"Content-Type": "application/x-ndjson"},
-                    )
-                    logger.info(f"Successfully loaded {success} documents in batch.")
-                    if failed:
-                        logger.warning(f"Failed to load {failed} documents in batch.")
-                except Exception as e:
-                    logger.error(f"Failed to load batch starting at index %s: %s", i, e)
-                if batch:
-                    if state_param == "id":
-                        state_param = "_id"
-                    last_loaded = batch[-1].get(state_param)
-                    self.state.set_state(state_key, last_loaded)
-        except Exception as e:
-            logger.error("Failed to load data to Elasticsearch: %s" % e)
+        if raw:
+            self.send_raw_bulk(data)
+        else:
+            self.send_bulk(data)
+        self.state.set_state(state_key, checkpoint)
 
     def create_es_mapping(self, pydantic_model: Type[BaseModel], index_name: str):
         mapping = {}
@@ -121,56 +236,197 @@ class ElasticSearchLoader:
 
         return mapping
 
-    @backoff.on_exception(backoff.expo, Exception, max_tries=5, jitter=None)
-    def create_index(
+    def index_body(
         self, model: Type[BaseModel], index_name: str, settings: dict = None
-    ):
+    ) -> dict:
+        """Тело запроса на создание индекса: из настроек или по pydantic-модели."""
         settings = settings or {}
-        settings["index_name"] = index_name
-        if settings[index_name]:
-            mapping = settings[index_name]
-        else:
-            mapping = self.create_es_mapping(model, index_name)
+        if settings.get(index_name):
+            return settings[index_name]
+        return {"mappings": {"properties": self.create_es_mapping(model, index_name)}}
 
+    def get_alias_indices(self, alias: str) -> List[str]:
+        """Возвращает индексы, на которые указывает алиас."""
         try:
-            logger.info("Creating index '%s'..." % index_name)
-            if not self.es.indices.exists(index=index_name):
-                self.es.indices.create(index=index_name, body=mapping)
-                logger.info("Index: '%s' is created." % index_name)
-            else:
-                logger.info("Index: '%s' already exists." % index_name)
-        except RequestError as e:
-            logger.error(
-                f"Failed to create index: %s. Error: %s" % ({index_name}, str(e))
-            )
-        except NotFoundError as e:
-            logger.error(f"Elasticsearch service not found. Error: %s" % str(e))
-        except Exception as e:
-            logger.error(
-                f"An unexpected error occurred while creating the index: %s" % str(e)
-            )
+            return list(self.es.indices.get_alias(name=alias).keys())
+        except NotFoundError:
+            return []
 
-    def load_updates(self, data, state_key, last_loaded):
+    def needs_rebuild(
+        self, model: Type[BaseModel], alias: str, settings: dict = None
+    ) -> bool:
         """
-        Загружает данные в Elasticsearch с использованием bulk-запроса.
+        Проверяет, нужно ли пересобрать индекс: алиаса ещё нет или схема
+        индекса, на который он указывает, отличается от текущей.
 
-        :param data: Список словарей с данными для загрузки.
-        :param state_key: Ключ состояния.
-        :param last_loaded дата последнего обновления загружаемых данных.
-        :return: None
+        :param model: Pydantic-модель документа.
+        :param alias: Имя алиаса.
+        :param settings: Настройки индексов.
+        :return: True, если нужна новая версия индекса.
+        """
+        indices = self.get_alias_indices(alias)
+        if not indices:
+            return True
+        mapping = self.es.indices.get_mapping(index=indices[0])[indices[0]]
+        current_hash = mapping["mappings"].get("_meta", {}).get("settings_hash")
+        return current_hash != settings_hash(self.index_body(model, alias, settings))
+
+    @backoff.on_exception(
+        backoff.expo, (ConnectionError, ConnectionTimeout), max_tries=5, jitter=None
+    )
+    def create_versioned_index(
+        self, model: Type[BaseModel], alias: str, settings: dict = None
+    ) -> str:
+        """
+        Создаёт новую версию индекса вида <alias>_v<N>.
+
+        Если уже есть версия без алиаса с той же схемой (settings_hash),
+        возвращается она: так повтор запроса, который завершился по
+        таймауту, но создал индекс на сервере, не оставляет лишних версий.
+
+        :param model: Pydantic-модель документа.
+        :param alias: Имя алиаса.
+        :param settings: Настройки индексов.
+        :return: Имя созданного индекса.
         """
-        logger.info(f"Found {len(data)} updates from Movies.")
+        body = dict(self.index_body(model, alias, settings))
+        body_hash = settings_hash(body)
+        existing = self.es.indices.get(index=f"{alias}_v*", expand_wildcards="all")
+        versions = {
+            int(name.rsplit("_v", 1)[1]): index
+            for name, index in existing.items()
+            if name.rsplit("_v", 1)[1].isdigit()
+        }
+        unused = [
+            version
+            for version, index in versions.items()
+            if not index.get("aliases")
+            and index.get("mappings", {}).get("_meta", {}).get("settings_hash")
+            == body_hash
+        ]
+        if unused:
+            index_name = f"{alias}_v{max(unused)}"
+            logger.info("Index: '%s' already exists, reusing it." % index_name)
+            return index_name
+        index_name = f"{alias}_v{max(versions, default=0) + 1}"
+        body["mappings"] = {
+            **body["mappings"],
+            "_meta": {**body["mappings"].get("_meta", {}), "settings_hash": body_hash},
+        }
+        self.es.indices.create(index=index_name, body=body)
+        logger.info("Index: '%s' is created." % index_name)
+        return index_name
+
+    def iter_document_ids(self, index_name: str, batch_size: int) -> Iterator[str]:
+        """
+        Выдаёт идентификаторы документов индекса в порядке возрастания.
+
+        Используется point in time и search_after по полю id, поэтому
+        идентификаторы не загружаются в память все сразу.
+
+        :param index_name: Имя индекса или алиаса.
+        :param batch_size: Размер страницы поиска.
+        :return: Итератор по идентификаторам.
+        """
+        pit_id = self.es.open_point_in_time(index=index_name, keep_alive="5m")["id"]
+        search_after = None
         try:
-            success, failed = bulk(
-                self.es,
-                data,
-                request_timeout=200,
-                headers={"Content-Type": "application/x-ndjson"},
-            )
-            logger.info(f"Successfully loaded {success} documents in batch.")
-            self.state.set_state(state_key, last_loaded.isoformat())
-            if failed:
-                logger.warning(f"Failed to load {failed} documents in batch.")
+            while True:
+                response = self.es.search(
+                    pit={"id": pit_id, "keep_alive": "5m"},
+                    query={"exists": {"field": "id"}},
+                    sort=[{"id": "asc"}],
+                    size=batch_size,
+                    source=False,
+                    search_after=search_after,
+                )
+                pit_id = response["pit_id"]
+                hits = response["hits"]["hits"]
+                if not hits:
+                    return
+                for hit in hits:
+                    yield hit["sort"][0]
+                search_after = hits[-1]["sort"]
+        finally:
+            self.es.close_point_in_time(id=pit_id)
 
-        except Exception as e:
-            logger.error(f"Failed to load batch starting at index %s: %s", e)
+    def count(self, index_name: str) -> int:
+        """Возвращает количество документов в индексе."""
+        self.es.indices.refresh(index=index_name)
+        return self.es.count(index=index_name)["count"]
+
+    def switch_alias(self, alias: str, index_name: str) -> None:
+        """
+        Атомарно переключает алиас на новый индекс и удаляет старые версии.
+
+        Если под именем алиаса существует обычный индекс (загрузка до
+        перехода на версии), он удаляется в том же запросе.
+
+        :param alias: Имя алиаса.
+        :param index_name: Индекс, на который переключается алиас.
+        """
+        old_indices = [
+            name for name in self.get_alias_indices(alias) if name != index_name
+        ]
+        actions = [{"add": {"index": index_name, "alias": alias}}]
+        actions += [{"remove": {"index": name, "alias": alias}} for name in old_indices]
+        if alias in self.es.indices.get(index=alias, ignore_unavailable=True):
+            actions.append({"remove_index": {"index": alias}})
+        self.es.indices.update_aliases(actions=actions)
+        logger.info("Alias '%s' now points to '%s'." % (alias, index_name))
+        for name in old_indices:
+            self.es.indices.delete(index=name)
+            logger.info("Index: '%s' is deleted." % name)
+
+    def ingest_restore_settings(
+        self, model: Type[BaseModel], alias: str, settings: dict = None
+    ) -> Dict[str, Any]:
+        """
+        Значения, которые bulk_ingest устанавливает после загрузки.
+
+        Берутся из тела индекса (настройки индексов или pydantic-модель),
+        а не из самого индекса: после аварийного завершения загрузки в нём
+        остаются значения режима массовой загрузки.
+
+        :param model: Pydantic-модель документа.
+        :param alias: Имя алиаса.
+        :param settings: Настройки индексов.
+        :return: Настройки индекса в плоском виде (index.*).
+        """
+        body = self.index_body(model, alias, settings).get("settings", {})
+        restore = {}
+        for name, default in INGEST_SETTINGS_DEFAULTS.items():
+            value = body.get(name, body.get(f"index.{name}"))
+            if value is None:
+                value = body.get("index", {}).get(name, default)
+            restore[f"index.{name}"] = value
+        return restore
+
+    @contextmanager
+    def bulk_ingest(self, index_name: str, restore: Dict[str, Any]) -> Iterator[None]:
+        """
+        Режим массовой загрузки: на время загрузки отключает обновление
+        индекса и реплики, после загрузки (в том числе при ошибке)
+        устанавливает значения restore.
+
+        :param index_name: Имя индекса.
+        :param restore: Настройки индекса после загрузки
+            (см. ingest_restore_settings).
+        """
+        logger.info("Enabling bulk ingest settings for index '%s'." % index_name)
+        self.es.indices.put_settings(
+            index=index_name,
+            settings={"index.refresh_interval": "-1", "index.number_of_replicas": 0},
+        )
+        try:
+            yield
+        finally:
+            logger.info("Restoring settings for index '%s': %s" % (index_name, restore))
+            self.es.indices.put_settings(index=index_name, settings=restore)
+            self.es.indices.refresh(index=index_name)
+        if self.config.force_merge_after_load:
+            logger.info("Force merging index '%s'..." % index_name)
+            self.es.options(request_timeout=None).indices.forcemerge(
+                index=index_name,
+                max_num_segments=self.config.force_merge_max_segments,
+            )
@@ -1,18 +1,39 @@
 import logging
-from time import sleep
-from typing import Type
+from contextlib import nullcontext
+from functools import partial
+from time import sleep, time
+from typing import Callable, ContextManager, Iterator, List, Optional, Type
+from uuid import UUID
 
 from pydantic import BaseModel
 
 from etl.data_transform import DataTransform
-from etl.db_extractions import DBExtractions
+from etl.db_extractions import NULL_MODIFIED, DBExtractions
 from etl.elastic import ElasticSearchLoader
+from etl.pipeline import Pipeline
 from etl.settings import Settings
 from etl.state import State
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Таблица-источник изменений -> ключ состояния с отметкой последнего изменения.
+CHANGE_SOURCES = {
+    "film_work": "last_update_fw",
+    "genre": "last_updated_genre",
+    "person": "last_updated_person",
+    "genre_film_work": "last_created_genre_film_work",
+    "person_film_work": "last_created_person_film_work",
+}
+CHANGE_LOG_STATE_KEY = "last_change_log_id"
+# Сколько раз догрузка и сверка повторяются, пока количество документов
+# новой версии индекса не совпадёт с PostgreSQL.
+PUBLISH_ATTEMPTS = 3
+
+
+class IndexVerificationError(Exception):
+    """Новая версия индекса не совпадает с PostgreSQL, алиас не переключён."""
+
 
 class ElasticExtraction:
     def __init__(
@@ -20,75 +41,316 @@ class ElasticExtraction:
         setup: Settings,
         state: State,
         data_transform: DataTransform,
+        shard: Optional[int] = None,
     ):
         self.setup = setup
         self.state = state
-        self.pg = DBExtractions(self.setup, self.state)
+        self.shard = shard
+        self.pg = DBExtractions(
+            self.setup,
+            self.state,
+            shard=None if shard is None else (shard, setup.shard_count),
+        )
         self.es = ElasticSearchLoader(self.setup, self.state)
         self.data_transform = data_transform
 
+    def _key(self, key: str) -> str:
+        """Ключ состояния с учётом шарда: у каждого шарда свои отметки."""
+        return key if self.shard is None else f"{key}:shard{self.shard}"
+
     def transform_data_from_pg(
         self, model: Type[BaseModel], index_name, settings, state_key
     ):
-        self.es.create_index(model, index_name, settings)
-        logger.info("Extracting data from PostgreSQL...")
-        pg_data = self.pg.extract_data()
-        last_update = pg_data[-1]["modified"]
-        transformed_movies_data = self.data_transform.transform_fw_data(pg_data)
-        if transformed_movies_data and transformed_movies_data[-1][
-            "_id"
-        ] == self.state.get_state(key=state_key):
-            logger.info("Movie data already loaded, skipping.")
+        """
+        Полная загрузка фильмов в Elasticsearch.
+
+        Если алиаса index_name ещё нет или схема индекса изменилась,
+        данные загружаются в новую версию индекса, которая после догрузки,
+        сверки с PostgreSQL и проверки количества документов атомарно
+        подключается к алиасу (см. publish_index). Иначе догружаются
+        записи, изменённые после сохранённой позиции.
+        """
+        building_index = self.prepare_index(model, index_name, settings)
+        with self.ingest(building_index, model, index_name, settings):
+            self.load_full(building_index or index_name, state_key, building_index)
+        if building_index:
+            self.publish_index(
+                index_name,
+                building_index,
+                partial(self.load_full, building_index, state_key, building_index),
+            )
+        logger.info("Data successfully loaded to Elasticsearch.")
+
+    def prepare_index(
+        self, model: Type[BaseModel], index_name: str, settings: dict
+    ) -> Optional[str]:
+        """
+        Возвращает собираемую версию индекса, создавая её при необходимости.
+
+        :return: Имя новой версии индекса или None, если алиас актуален.
+        """
+        building_index = self.state.get_state("building_index")
+        if building_index is None and self.es.needs_rebuild(
+            model, index_name, settings
+        ):
+            building_index = self.es.create_versioned_index(model, index_name, settings)
+            self.state.set_state("building_index", building_index)
+            self.state.flush()
+        return building_index
+
+    def ingest(
+        self,
+        building_index: Optional[str],
+        model: Type[BaseModel],
+        index_name: str,
+        settings: dict,
+    ) -> ContextManager:
+        """Режим массовой загрузки для собираемой версии индекса."""
+        if building_index and self.setup.bulk_ingest_mode:
+            restore = self.es.ingest_restore_settings(model, index_name, settings)
+            return self.es.bulk_ingest(building_index, restore)
+        return nullcontext()
+
+    def load_full(
+        self, target_index: str, state_key: str, building_index: Optional[str]
+    ) -> None:
+        """
+        Загружает фильмы в target_index, продолжая с сохранённой позиции.
+
+        Позиция хранится вместе с именем индекса: загрузка в новую версию
+        индекса начинается с начала, а догрузка в алиас продолжает
+        с позиции последней загрузки.
+        """
+        state_key = self._key(state_key)
+        saved = self.state.get_state(state_key)
+        if not isinstance(saved, dict) or (
+            building_index and saved.get("index") != building_index
+        ):
+            saved = {}
+        position = saved.get("position")
+        if position:
+            logger.info("Resuming data extraction after %s...", position)
         else:
-            self.es.load_data_to_elasticsearch(
-                data=transformed_movies_data,
-                batch_size=self.setup.batch_size,
-                state_key=state_key,
-                state_param="id",
+            logger.info("Extracting data from PostgreSQL...")
+        raw = self.setup.sql_documents
+        batches = self._iter_full_load(target_index, position)
+        if raw:
+            # Документы уже собраны в PostgreSQL, преобразование не нужно.
+            transform = list
+        else:
+            transform = partial(
+                self.data_transform.transform_fw_data, index_name=target_index
             )
-            self.state.set_state("last_update", last_update.isoformat())
-            logger.info("Data successfully loaded to Elasticsearch.")
-
-    def update_fw_data(self, state_key):
-        if self.state.get_state(state_key) is None:
-            db_last_update = self.state.get_state("last_update")
-            self.state.set_state(state_key, db_last_update)
-        while self.pg.get_updated_fw(state_key):
-            updated_fw_data, last_update = self.pg.get_updated_fw(state_key)
-            bulk_movies_data = self.data_transform.transform_updates_fw(updated_fw_data)
-            self.es.load_updates(bulk_movies_data, state_key, last_update)
+        if self.setup.pipeline_enabled:
+            load = self.es.send_raw_bulk if raw else self.es.send_bulk
+            self._run_pipeline(batches, transform, load, state_key)
         else:
-            logger.info("No updated film work data found. Waiting for the next update.")
+            for checkpoint, pg_data in batches:
+                self.es.load_data_to_elasticsearch(
+                    data=transform(pg_data),
+                    state_key=state_key,
+                    checkpoint=checkpoint,
+                    raw=raw,
+                )
+        saved = self.state.get_state(state_key)
+        if saved and saved.get("position"):
+            with self.state.transaction():
+                self.state.set_state(self._key("last_update"), saved["position"][0])
+
+    def publish_index(
+        self, alias: str, index_name: str, catch_up: Callable[[], None]
+    ) -> None:
+        """
+        Догружает новую версию индекса и переключает на неё алиас.
+
+        Полная загрузка читает снимок данных на момент открытия курсора,
+        поэтому фильмы, добавленные, изменённые или удалённые за время
+        загрузки, в индексе не отражены. Перед проверкой количества
+        документов catch_up догружает изменённые после сохранённой позиции
+        фильмы, а сверка множеств идентификаторов (reconcile) добавляет
+        недостающие и удаляет лишние документы. При изменениях во время
+        самой сверки она повторяется до PUBLISH_ATTEMPTS раз.
 
-    def update_genre(self, state_key):
-        while self.pg.get_updated_objects_ids("genre", state_key):
-            genre_updates, last_update_genre = self.pg.get_updated_objects_ids(
-                "genre", state_key
+        :param alias: Имя алиаса.
+        :param index_name: Собранная версия индекса.
+        :param catch_up: Догрузка index_name с сохранённой позиции.
+        :raises IndexVerificationError: Если количество документов так и не
+            совпало с PostgreSQL; алиас и building_index в состоянии
+            остаются прежними, следующий запуск продолжит сборку.
+        """
+        for attempt in range(1, PUBLISH_ATTEMPTS + 1):
+            catch_up()
+            self.reconcile(index_name)
+            pg_count = self.pg.count_film_works()
+            es_count = self.es.count(index_name)
+            if pg_count == es_count:
+                break
+            logger.warning(
+                "Index '%s' has %s documents, PostgreSQL has %s (attempt %s of %s).",
+                index_name,
+                es_count,
+                pg_count,
+                attempt,
+                PUBLISH_ATTEMPTS,
             )
-            updates_from_pg = self.pg.updates_genres(genre_updates)
-            transformed_genre_data = self.data_transform.transform_genres_updates(
-                updates_from_pg
+        else:
+            raise IndexVerificationError(
+                f"Index '{index_name}' does not match PostgreSQL, "
+                f"alias '{alias}' is left unchanged."
             )
-            self.es.load_updates(transformed_genre_data, state_key, last_update_genre)
+        self.es.switch_alias(alias, index_name)
+        with self.state.transaction():
+            self.state.set_state("building_index", None)
+
+    def _iter_full_load(
+        self, target_index: str, after: Optional[list]
+    ) -> Iterator[tuple[dict, list]]:
+        """Выдаёт пары (позиция keyset-курсора, пачка строк) для полной загрузки."""
+        pg_batches = self.pg.extract_data(
+            self.setup.batch_size,
+            after=after,
+            index_name=target_index if self.setup.sql_documents else None,
+        )
+        for pg_data in pg_batches:
+            last_row = pg_data[-1]
+            modified = last_row["modified"] or NULL_MODIFIED
+            position = [modified.isoformat(), str(last_row["id"])]
+            yield {"index": target_index, "position": position}, pg_data
+
+    def _run_pipeline(
+        self,
+        batches: Iterator[tuple[list, list]],
+        transform: Callable[[list], list],
+        load: Callable[[list], None],
+        state_key: str,
+    ):
+        """Загружает пачки конвейером с параллельными стадиями."""
+        pipeline = Pipeline(
+            transform=transform,
+            load=load,
+            commit=partial(self.state.set_state, state_key),
+            transform_workers=self.setup.transform_workers,
+            load_workers=self.setup.load_workers,
+            queue_size=self.setup.pipeline_queue_size,
+        )
+        pipeline.run(batches)
+
+    def sync_updates(self) -> None:
+        """
+        Один цикл инкрементальной синхронизации.
+
+        Собирает множество фильмов, затронутых изменениями во всех таблицах
+        из CHANGE_SOURCES и в журнале изменений связей, и переиндексирует
+        каждый фильм ровно один раз полным документом. Отметки всех
+        источников сохраняются вместе после успешной загрузки.
+        """
+        affected, watermarks = self._collect_changes()
+        if affected:
+            logger.info("Found %s updated movies.", len(affected))
+            affected = sorted(affected)
+            batch_size = self.setup.batch_size
+            for i in range(0, len(affected), batch_size):
+                self._reindex(affected[i : i + batch_size])
         else:
-            logger.info("No updated genres data found. Waiting for the next update.")
+            logger.info("No updated data found. Waiting for the next update.")
+        with self.state.transaction():
+            for state_key, since in watermarks.items():
+                self.state.set_state(self._key(state_key), since)
+        consumed_id = self.state.get_state(self._key(CHANGE_LOG_STATE_KEY))
+        if consumed_id:
+            self.pg.prune_change_log(consumed_id, self.setup.change_log_retention_days)
 
-    def update_person(self, state_key):
-        while self.pg.get_updated_objects_ids("person", state_key):
-            person_updates, last_update = self.pg.get_updated_objects_ids(
-                "person", state_key
-            )
-            updt_from_pg = self.pg.update_persons(person_updates)
-            if person_updates:
-                transformed_person_data = self.data_transform.transform_persons_updates(
-                    updt_from_pg
-                )
-                self.es.load_updates(transformed_person_data, state_key, last_update)
-                if person_updates is None:
-                    logger.info(
-                        "Last update is None, but no errors occurred. Please check the data source."
-                    )
-                else:
-                    logger.info("Last update processed successfully.")
+    def _reindex(self, fw_ids: List[UUID], index_name: str = "movies") -> None:
+        """
+        Переиндексирует фильмы полными документами.
+
+        Фильмы, которых больше нет в PostgreSQL, удаляются из индекса.
+        """
+        if self.setup.sql_documents:
+            movies = self.pg.extract_movies_by_ids(fw_ids, index_name=index_name)
+            actions = []
+            if movies:
+                self.es.send_raw_bulk(movies)
         else:
-            logger.info("No updated persons data found. Waiting for the next update.")
+            movies = self.pg.extract_movies_by_ids(fw_ids)
+            actions = self.data_transform.transform_fw_data(
+                movies, index_name=index_name
+            )
+        found = {movie["id"] for movie in movies}
+        deleted = [fw_id for fw_id in fw_ids if fw_id not in found]
+        if deleted:
+            logger.info("Deleting %s movies from Elasticsearch.", len(deleted))
+        actions += self.data_transform.transform_deleted(deleted, index_name)
+        if actions:
+            self.es.send_bulk(actions)
+
+    def reconcile_if_due(self) -> None:
+        """Запускает сверку индекса раз в reconcile_interval секунд."""
+        if not self.setup.reconcile_interval:
+            return
+        last_reconcile = self.state.get_state(self._key("last_reconcile")) or 0
+        if time() - last_reconcile < self.setup.reconcile_interval:
+            return
+        self.reconcile()
+        self.state.set_state(self._key("last_reconcile"), time())
+
+    def reconcile(self, index_name: str = "movies") -> None:
+        """
+        Сверяет множества идентификаторов в PostgreSQL и Elasticsearch.
+
+        Оба потока идентификаторов отсортированы, поэтому сравниваются
+        слиянием без загрузки в память. Отсутствующие в индексе фильмы
+        загружаются, лишние документы удаляются.
+        """
+        logger.info("Reconciling index '%s' with PostgreSQL...", index_name)
+        batch_size = self.setup.batch_size
+        pg_ids = self.pg.iter_film_work_ids(batch_size)
+        es_ids = (
+            es_id
+            for es_id in self.es.iter_document_ids(index_name, batch_size)
+            if self.pg.owns(es_id)
+        )
+        missing, extra = [], []
+        pg_id, es_id = next(pg_ids, None), next(es_ids, None)
+        while pg_id is not None or es_id is not None:
+            if es_id is None or (pg_id is not None and pg_id < es_id):
+                missing.append(UUID(pg_id))
+                pg_id = next(pg_ids, None)
+            elif pg_id is None or es_id < pg_id:
+                extra.append(es_id)
+                es_id = next(es_ids, None)
+            else:
+                pg_id, es_id = next(pg_ids, None), next(es_ids, None)
+            if len(missing) >= batch_size:
+                self._reindex(missing, index_name)
+                missing = []
+            if len(extra) >= batch_size:
+                self._delete(extra, index_name)
+                extra = []
+        if missing:
+            self._reindex(missing, index_name)
+        if extra:
+            self._delete(extra, index_name)
+        logger.info("Index '%s' is reconciled.", index_name)
+
+    def _delete(self, fw_ids: List[str], index_name: str) -> None:
+        self.es.send_bulk(self.data_transform.transform_deleted(fw_ids, index_name))
+
+    def _collect_changes(self) -> tuple[set, dict]:
+        """Собирает затронутые фильмы и новые отметки источников изменений."""
+        affected = set()
+        watermarks = {}
+        for table, state_key in CHANGE_SOURCES.items():
+            since = self.state.get_state(self._key(state_key))
+            if since is None:
+                since = self.state.get_state(self._key("last_update"))
+            while changed := self.pg.get_changed_film_work_ids(table, since):
+                fw_ids, since = changed
+                affected.update(fw_ids)
+                watermarks[state_key] = since
+        last_log_id = self.state.get_state(self._key(CHANGE_LOG_STATE_KEY)) or 0
+        while changed := self.pg.get_logged_changes(last_log_id):
+            fw_ids, last_log_id = changed
+            affected.update(fw_ids)
+            watermarks[CHANGE_LOG_STATE_KEY] = last_log_id
+        return {fw_id for fw_id in affected if self.pg.owns(fw_id)}, watermarks
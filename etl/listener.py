@@ -0,0 +1,81 @@
+import logging
+from time import monotonic
+from typing import List
+
+import backoff
+import psycopg
+
+from etl.serializers import loads
+from etl.settings import Settings
+
+logger = logging.getLogger(__name__)
+
+# Канал, в который пишет триггерная функция content.notify_etl_change().
+NOTIFY_CHANNEL = "content_changes"
+
+
+class ChangeListener:
+    """Ожидание уведомлений PostgreSQL об изменениях в схеме content.
+
+    Уведомления отправляют триггеры из миграции movies_admin
+    0003_etl_notify_triggers. Они служат сигналом к запуску цикла
+    синхронизации: сами изменения по-прежнему выбираются по отметкам
+    в состоянии, поэтому уведомления, потерянные при разрыве
+    соединения, не приводят к потере данных.
+    """
+
+    def __init__(self, config: Settings):
+        self.config = config
+        self.conn = None
+
+    @property
+    def connected(self) -> bool:
+        return self.conn is not None and not self.conn.closed
+
+    @backoff.on_exception(backoff.expo, psycopg.OperationalError, max_time=300)
+    def connect(self) -> None:
+        self.close()
+        self.conn = psycopg.connect(
+            host=self.config.sql_host,
+            dbname=self.config.postgres_db,
+            user=self.config.postgres_user,
+            password=self.config.postgres_password,
+            autocommit=True,
+        )
+        self.conn.execute(f"LISTEN {NOTIFY_CHANNEL};")
+        logger.info("Listening for changes on '%s'.", NOTIFY_CHANNEL)
+
+    def close(self) -> None:
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def wait(self, timeout: float) -> List[dict]:
+        """
+        Ждёт изменения и собирает их в микропачку.
+
+        После первого уведомления ещё notify_batch_window секунд собирает
+        следующие, но не больше notify_batch_size штук.
+
+        :param timeout: Сколько ждать первое уведомление, секунд.
+        :return: Полученные уведомления (пустой список по таймауту).
+        """
+        changes = [
+            loads(notify.payload)
+            for notify in self.conn.notifies(timeout=timeout, stop_after=1)
+        ]
+        if not changes:
+            return changes
+        deadline = monotonic() + self.config.notify_batch_window
+        while (
+            len(changes) < self.config.notify_batch_size
+            and (remaining := deadline - monotonic()) > 0
+        ):
+            changes.extend(
+                loads(notify.payload)
+                for notify in self.conn.notifies(
+                    timeout=remaining,
+                    stop_after=self.config.notify_batch_size - len(changes),
+                )
+            )
+        return changes
@@ -1,37 +1,170 @@
 import logging
+import multiprocessing
+import signal
+import sys
+from functools import partial
+from multiprocessing.connection import wait
 from time import sleep
+from typing import Optional
 
+import psycopg
 from django import setup
-from settings import Movie, Settings, state
+from settings import Movie, Settings
 
 from etl.data_transform import DataTransform
 from etl.elastic_extraction import ElasticExtraction
+from etl.listener import ChangeListener
 from etl.settings import elastic_settings
+from etl.state import create_state
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+INDEX_NAME = "movies"
+FULL_LOAD_STATE_KEY = "full_load_cursor"
+
+
 def main(elastic_extraction: ElasticExtraction):
+    if elastic_extraction.setup.shard_count > 1:
+        supervise(elastic_extraction)
+        return
     elastic_extraction.transform_data_from_pg(
         model=Movie,
-        index_name="movies",
+        index_name=INDEX_NAME,
         settings=elastic_settings,
-        state_key="last_loaded_id",
+        state_key=FULL_LOAD_STATE_KEY,
     )
+    sync_forever(elastic_extraction)
+
+
+def sync_forever(elastic_extraction: ElasticExtraction):
+    """Бесконечная инкрементальная синхронизация."""
+    if elastic_extraction.setup.notify_enabled:
+        listen_updates(elastic_extraction, ChangeListener(elastic_extraction.setup))
     while True:
-        elastic_extraction.update_fw_data("last_update_fw")
-        elastic_extraction.update_genre("last_updated_genre")
-        elastic_extraction.update_person("last_updated_person")
+        elastic_extraction.sync_updates()
+        elastic_extraction.reconcile_if_due()
         sleep(elastic_extraction.setup.update_frequency)
 
 
+def listen_updates(elastic_extraction: ElasticExtraction, listener: ChangeListener):
+    """
+    Синхронизация по уведомлениям LISTEN/NOTIFY.
+
+    Цикл синхронизации запускается сразу после микропачки уведомлений,
+    а без уведомлений — раз в notify_poll_interval секунд. После каждого
+    (пере)подключения выполняется догоняющий опрос по отметкам.
+    """
+    while True:
+        try:
+            if not listener.connected:
+                listener.connect()
+                elastic_extraction.sync_updates()
+            changes = listener.wait(elastic_extraction.setup.notify_poll_interval)
+            if changes:
+                logger.info("Received %s change notifications.", len(changes))
+            elastic_extraction.sync_updates()
+            elastic_extraction.reconcile_if_due()
+        except psycopg.OperationalError as e:
+            logger.error("Lost connection to PostgreSQL listener: %s", e)
+            listener.close()
+
+
+def supervise(elastic_extraction: ElasticExtraction):
+    """
+    Запуск ETL несколькими процессами, по одному на шард.
+
+    Фильмы делятся между shard_count процессами по идентификатору, каждый
+    процесс выгружает, валидирует и загружает только свой шард, поэтому
+    преобразование данных не упирается в одно ядро и GIL. Супервизор
+    создаёт новую версию индекса до запуска шардов и переключает алиас
+    после того, как все шарды завершили полную загрузку.
+    """
+    shard_count = elastic_extraction.setup.shard_count
+    building_index = elastic_extraction.prepare_index(
+        Movie, INDEX_NAME, elastic_settings
+    )
+    with elastic_extraction.ingest(building_index, Movie, INDEX_NAME, elastic_settings):
+        run_shards(shard_count, building_index or INDEX_NAME, building_index)
+    if building_index:
+        elastic_extraction.publish_index(
+            INDEX_NAME,
+            building_index,
+            partial(run_shards, shard_count, building_index, building_index),
+        )
+    logger.info("Data successfully loaded to Elasticsearch.")
+    run_shards(shard_count)
+
+
+def run_shards(shard_count: int, *args):
+    """
+    Запускает процессы шардов и ждёт их завершения.
+
+    Если какой-либо шард завершился с ошибкой, остальные останавливаются.
+    """
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(
+            target=run_shard,
+            args=(shard, *args),
+            name=f"etl-shard-{shard}",
+            daemon=True,
+        )
+        for shard in range(shard_count)
+    ]
+    for process in processes:
+        process.start()
+    running = {process.sentinel: process for process in processes}
+    while running:
+        for sentinel in wait(list(running)):
+            process = running.pop(sentinel)
+            process.join()
+            if process.exitcode != 0:
+                for other in running.values():
+                    other.terminate()
+                raise RuntimeError(
+                    f"Process {process.name} exited with code {process.exitcode}"
+                )
+
+
+def run_shard(
+    shard: int,
+    target_index: Optional[str] = None,
+    building_index: Optional[str] = None,
+):
+    """
+    Точка входа процесса шарда.
+
+    С target_index выполняет полную загрузку шарда в этот индекс,
+    без него — бесконечную синхронизацию изменений шарда.
+    """
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    my_settings = Settings()
+    elastic_extraction = ElasticExtraction(
+        my_settings,
+        create_state(my_settings, shard),
+        DataTransform(Movie, validate=not my_settings.trust_sql_output),
+        shard=shard,
+    )
+    if target_index is None:
+        sync_forever(elastic_extraction)
+    else:
+        elastic_extraction.load_full(target_index, FULL_LOAD_STATE_KEY, building_index)
+
+
 if __name__ == "__main__":
     try:
-        data_transform = DataTransform(Movie)
         my_settings = Settings()
+        data_transform = DataTransform(Movie, validate=not my_settings.trust_sql_output)
+        state = create_state(my_settings)
+        # Завершение по SIGTERM через SystemExit, чтобы состояние сохранилось.
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
         elastic_extraction = ElasticExtraction(my_settings, state, data_transform)
 
         main(elastic_extraction)
     except Exception as e:
         logger.error("Failed to start application: %s", str(e))
+        # Ненулевой код, чтобы оркестратор перезапустил ETL, а не считал
+        # его завершившимся успешно.
+        sys.exit(1)
@@ -0,0 +1,131 @@
+import logging
+import queue
+import threading
+from typing import Any, Callable, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class Pipeline:
+    """Конвейер extract → transform → load.
+
+    Каждая стадия работает в своих потоках, стадии связаны очередями
+    ограниченного размера: если загрузка в Elasticsearch не успевает,
+    очереди заполняются и выгрузка из PostgreSQL приостанавливается.
+    Позиции курсора фиксируются строго в порядке выгрузки пачек, даже
+    если несколько загрузчиков завершают работу в другом порядке.
+    """
+
+    def __init__(
+        self,
+        transform: Callable[[List[dict]], List[dict]],
+        load: Callable[[List[dict]], None],
+        commit: Callable[[Any], None],
+        transform_workers: int = 1,
+        load_workers: int = 1,
+        queue_size: int = 4,
+    ):
+        self.transform = transform
+        self.load = load
+        self.commit = commit
+        self.transform_workers = transform_workers
+        self.load_workers = load_workers
+        self.transform_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.load_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._error: Optional[BaseException] = None
+        self._commit_lock = threading.Lock()
+        self._pending: dict = {}
+        self._next_seq = 0
+
+    def run(self, batches: Iterable[Tuple[Any, List[dict]]]) -> None:
+        """
+        Прогоняет пачки через конвейер.
+
+        :param batches: Итератор пар (позиция курсора, строки пачки).
+        :return: None
+        """
+        transformers = self._start(self.transform_workers, self._transform_worker)
+        loaders = self._start(self.load_workers, self._load_worker)
+        try:
+            for seq, (checkpoint, rows) in enumerate(batches):
+                if not self._put(self.transform_queue, (seq, checkpoint, rows)):
+                    break
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            self._shutdown(self.transform_queue, transformers)
+            self._shutdown(self.load_queue, loaders)
+        if self._error is not None:
+            raise self._error
+
+    def _start(self, count: int, target: Callable[[], None]) -> List[threading.Thread]:
+        threads = [
+            threading.Thread(target=target, name=f"{target.__name__}-{i}", daemon=True)
+            for i in range(max(count, 1))
+        ]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def _shutdown(self, stage_queue: queue.Queue, threads: List[threading.Thread]):
+        for _ in threads:
+            self._put(stage_queue, _STOP, force=True)
+        for thread in threads:
+            thread.join()
+
+    def _put(self, stage_queue: queue.Queue, item: Any, force: bool = False) -> bool:
+        while force or not self._stop.is_set():
+            try:
+                stage_queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                if force and self._stop.is_set():
+                    return False
+        return False
+
+    def _get(self, stage_queue: queue.Queue) -> Any:
+        while True:
+            try:
+                return stage_queue.get(timeout=0.5)
+            except queue.Empty:
+                if self._stop.is_set():
+                    return _STOP
+
+    def _fail(self, error: BaseException) -> None:
+        logger.error("Pipeline stage failed: %s", error)
+        if self._error is None:
+            self._error = error
+        self._stop.set()
+
+    def _transform_worker(self) -> None:
+        while (item := self._get(self.transform_queue)) is not _STOP:
+            if self._stop.is_set():
+                continue
+            seq, checkpoint, rows = item
+            try:
+                actions = self.transform(rows)
+            except Exception as e:
+                self._fail(e)
+                continue
+            self._put(self.load_queue, (seq, checkpoint, actions))
+
+    def _load_worker(self) -> None:
+        while (item := self._get(self.load_queue)) is not _STOP:
+            if self._stop.is_set():
+                continue
+            seq, checkpoint, actions = item
+            try:
+                self.load(actions)
+                self._commit_in_order(seq, checkpoint)
+            except Exception as e:
+                self._fail(e)
+
+    def _commit_in_order(self, seq: int, checkpoint: Any) -> None:
+        with self._commit_lock:
+            self._pending[seq] = checkpoint
+            while self._next_seq in self._pending:
+                self.commit(self._pending.pop(self._next_seq))
+                self._next_seq += 1
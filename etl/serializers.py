@@ -0,0 +1,72 @@
+"""
+JSON-сериализация ETL.
+
+Если установлен orjson, используется он: кодирование в несколько раз
+быстрее стандартного json, а UUID и datetime сериализуются нативно.
+Без orjson те же функции работают через стандартный модуль json.
+"""
+
+import json
+from datetime import date
+from decimal import Decimal
+from typing import Any, Dict
+from uuid import UUID
+
+from elasticsearch.serializer import JsonSerializer, NdjsonSerializer, Serializer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def default(obj: Any) -> Any:
+    """Сериализация типов, которые не поддерживает JSON-кодировщик."""
+    if isinstance(obj, UUID):
+        return str(obj)
+    if isinstance(obj, date):
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError(f"Object of type {obj.__class__.__name__} is not serializable")
+
+
+if orjson is not None:
+
+    def dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, default=default)
+
+    loads = orjson.loads
+
+else:
+
+    def dumps(obj: Any) -> bytes:
+        return json.dumps(
+            obj, default=default, ensure_ascii=False, separators=(",", ":")
+        ).encode()
+
+    loads = json.loads
+
+
+class _FastJsonMixin:
+    def json_dumps(self, data: Any) -> bytes:
+        return dumps(data)
+
+    def json_loads(self, data: bytes) -> Any:
+        return loads(data)
+
+
+class FastJsonSerializer(_FastJsonMixin, JsonSerializer):
+    """Сериализатор application/json клиента Elasticsearch."""
+
+
+class FastNdjsonSerializer(_FastJsonMixin, NdjsonSerializer):
+    """Сериализатор application/x-ndjson (тела _bulk) клиента Elasticsearch."""
+
+
+def elastic_serializers() -> Dict[str, Serializer]:
+    """Сериализаторы для параметра serializers клиента Elasticsearch."""
+    return {
+        FastJsonSerializer.mimetype: FastJsonSerializer(),
+        FastNdjsonSerializer.mimetype: FastNdjsonSerializer(),
+    }
@@ -1,3 +1,5 @@
+import hashlib
+import json
 import os
 from datetime import datetime
 from typing import List, Optional
@@ -6,8 +8,6 @@ from uuid import UUID
 from pydantic import BaseModel, Field
 from pydantic.v1 import BaseSettings
 
-from etl.state import JsonFileStorage, State
-
 
 class Settings(BaseSettings):
     postgres_db: str
@@ -18,6 +18,34 @@ class Settings(BaseSettings):
     es_index: str
     batch_size: int
     update_frequency: int
+    pipeline_enabled: bool = False
+    pipeline_queue_size: int = 4
+    transform_workers: int = 1
+    load_workers: int = 2
+    bulk_workers: int = 1
+    bulk_chunk_size: int = 500
+    bulk_max_chunk_bytes: int = 100 * 1024 * 1024
+    bulk_request_timeout: int = 200
+    bulk_max_retries: int = 5
+    bulk_initial_backoff: float = 2
+    bulk_max_backoff: float = 600
+    bulk_ingest_mode: bool = True
+    force_merge_after_load: bool = False
+    force_merge_max_segments: int = 1
+    change_log_retention_days: int = 7
+    notify_enabled: bool = False
+    notify_batch_window: float = 0.5
+    notify_batch_size: int = 1000
+    notify_poll_interval: int = 300
+    reconcile_interval: int = 24 * 60 * 60
+    state_storage: str = "json"
+    state_file: str = "state.json"
+    redis_url: str = "redis://localhost:6379/0"
+    state_flush_every: int = 20
+    state_flush_interval: float = 5
+    shard_count: int = 1
+    trust_sql_output: bool = False
+    sql_documents: bool = False
 
     class Config:
         env_file = os.path.join(os.path.dirname(__file__), "../.env")
@@ -90,6 +118,7 @@ elastic_settings = {
         },
         "mappings": {
             "dynamic": "strict",
+            "_meta": {"document_version": 2},
             "properties": {
                 "id": {"type": "keyword"},
                 "imdb_rating": {"type": "float"},
@@ -133,5 +162,7 @@ elastic_settings = {
 }
 
 
-state_storage = JsonFileStorage("state.json")
-state = State(state_storage)
+def settings_hash(index_settings: dict) -> str:
+    """Отпечаток схемы индекса, по которому определяется необходимость пересборки."""
+    dumped = json.dumps(index_settings, sort_keys=True).encode()
+    return hashlib.sha1(dumped).hexdigest()
@@ -1,14 +1,42 @@
 import abc
+import atexit
 import json
 import logging
 import os
-from typing import Any, Dict
+import tempfile
+import threading
+from contextlib import contextmanager
+from time import monotonic
+from typing import Any, Dict, Iterator, Optional, Set
 from uuid import UUID
 
+import psycopg
+
+from etl.serializers import dumps, loads
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+class StateConflictError(Exception):
+    """Ключ состояния изменён другим процессом."""
+
+
+# Convert string back to UUID if possible
+def convert_uuid_from_string(obj):
+    if isinstance(obj, str):
+        try:
+            return UUID(obj)
+        except ValueError:
+            pass
+    return obj
+
+
 class BaseStorage(abc.ABC):
     """Абстрактное хранилище состояния.
 
@@ -26,6 +54,14 @@ class BaseStorage(abc.ABC):
     def retrieve_state(self) -> Dict[str, Any]:
         """Получить состояние из хранилища."""
 
+    def save_changes(self, state: Dict[str, Any], keys: Set[str]) -> None:
+        """Сохранить изменённые ключи состояния.
+
+        По умолчанию сохраняется всё состояние целиком; хранилища,
+        которые умеют обновлять отдельные ключи, переопределяют метод.
+        """
+        self.save_state(state)
+
 
 class JsonFileStorage(BaseStorage):
     """Implementation of storage using a local file. Format: JSON"""
@@ -34,19 +70,26 @@ class JsonFileStorage(BaseStorage):
         self.file_path = file_path
 
     def save_state(self, state: Dict[str, Any]) -> None:
-        """Save the state to the storage, converting UUID to string."""
-
-        # Convert UUIDs to string for JSON serialization
-        def convert_uuid(obj):
-            if isinstance(obj, UUID):
-                return str(obj)
-            raise logger.error(
-                f"Object of type {obj.__class__.__name__} is not serializable"
-            )
+        """Save the state to the storage, converting UUID to string.
 
+        The state is written to a temporary file which is fsynced and then
+        atomically renamed over the old one, so a crash mid-write never
+        leaves a truncated state file behind.
+        """
+        directory = os.path.dirname(os.path.abspath(self.file_path))
         try:
-            with open(self.file_path, "w") as f:
-                json.dump(state, f, ensure_ascii=False, indent=4, default=convert_uuid)
+            with tempfile.NamedTemporaryFile(
+                "wb", dir=directory, prefix=".state-", delete=False
+            ) as f:
+                f.write(dumps(state))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(f.name, self.file_path)
+            dir_fd = os.open(directory, os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
         except IOError as e:
             logger.error(f"Error writing to file {self.file_path}: {e}")
         except Exception as e:
@@ -54,16 +97,6 @@ class JsonFileStorage(BaseStorage):
 
     def retrieve_state(self) -> Dict[str, Any]:
         """Retrieve the state from the storage, converting strings back to UUID."""
-
-        # Convert string back to UUID if possible
-        def convert_uuid_from_string(obj):
-            if isinstance(obj, str):
-                try:
-                    return UUID(obj)
-                except ValueError:
-                    pass
-            return obj
-
         if not os.path.exists(self.file_path):
             logger.info(
                 f"No state file found at {self.file_path}. Returning empty state."
@@ -71,8 +104,8 @@ class JsonFileStorage(BaseStorage):
             return {}
 
         try:
-            with open(self.file_path, "r") as f:
-                state = json.load(f)
+            with open(self.file_path, "rb") as f:
+                state = loads(f.read())
                 return {
                     key: convert_uuid_from_string(value) for key, value in state.items()
                 }
@@ -87,18 +120,188 @@ class JsonFileStorage(BaseStorage):
             return {}
 
 
+class PostgresStorage(BaseStorage):
+    """Хранилище состояния в таблице content.etl_state.
+
+    Каждый ключ состояния хранится отдельной строкой и обновляется
+    upsert-ом, поэтому несколько процессов ETL с разными ключами
+    не затирают состояние друг друга. Каждое сохранение фиксирует
+    транзакцию (commit), поэтому хранилищу нужно отдельное соединение:
+    на соединении выгрузки commit закрыл бы серверный курсор полной
+    загрузки (см. create_state).
+    """
+
+    def __init__(self, conn: psycopg.Connection) -> None:
+        self.conn = conn
+
+    def save_state(self, state: Dict[str, Any]) -> None:
+        self.save_changes(state, set(state))
+
+    def save_changes(self, state: Dict[str, Any], keys: Set[str]) -> None:
+        query = """
+        INSERT INTO content.etl_state (key, value, modified)
+        VALUES (%s, %s::jsonb, now())
+        ON CONFLICT (key) DO UPDATE
+        SET value = EXCLUDED.value, modified = EXCLUDED.modified;
+        """
+        rows = [(key, dumps(state.get(key)).decode()) for key in keys]
+        with self.conn.cursor() as cursor:
+            cursor.executemany(query, rows)
+        self.conn.commit()
+
+    def retrieve_state(self) -> Dict[str, Any]:
+        with self.conn.cursor() as cursor:
+            cursor.execute("SELECT key, value FROM content.etl_state;")
+            rows = cursor.fetchall()
+        self.conn.commit()
+        return {key: convert_uuid_from_string(value) for key, value in rows}
+
+
+class RedisStorage(BaseStorage):
+    """Хранилище состояния в хеше Redis (или совместимом хранилище).
+
+    Ключи обновляются по принципу compare-and-set: значение перезаписывается,
+    только если в хранилище лежит то же значение, которое этот процесс
+    прочитал или записал последним. Иначе выбрасывается StateConflictError.
+    """
+
+    def __init__(self, url: str, key: str = "etl:state") -> None:
+        if redis is None:
+            raise ImportError("RedisStorage requires the 'redis' package.")
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.key = key
+        self._known: Dict[str, str] = {}
+
+    def save_state(self, state: Dict[str, Any]) -> None:
+        self.save_changes(state, set(state))
+
+    def save_changes(self, state: Dict[str, Any], keys: Set[str]) -> None:
+        keys = sorted(keys)
+        values = {key: dumps(state.get(key)).decode() for key in keys}
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(self.key)
+                    stored = dict(zip(keys, pipe.hmget(self.key, keys)))
+                    conflicts = [
+                        key for key in keys if stored[key] != self._known.get(key)
+                    ]
+                    if conflicts:
+                        raise StateConflictError(
+                            f"State keys changed by another process: {conflicts}"
+                        )
+                    pipe.multi()
+                    pipe.hset(self.key, mapping=values)
+                    pipe.execute()
+                    break
+                except redis.WatchError:
+                    continue
+        self._known.update(values)
+
+    def retrieve_state(self) -> Dict[str, Any]:
+        self._known = self.client.hgetall(self.key)
+        return {
+            key: convert_uuid_from_string(loads(value))
+            for key, value in self._known.items()
+        }
+
+
 class State:
-    """Класс для работы с состояниями."""
+    """Класс для работы с состояниями.
 
-    def __init__(self, storage: BaseStorage) -> None:
+    Изменения накапливаются в памяти и сбрасываются в хранилище каждые
+    flush_every изменений или раз в flush_interval секунд, а также при
+    выходе из transaction() и при завершении процесса.
+    """
+
+    def __init__(
+        self, storage: BaseStorage, flush_every: int = 1, flush_interval: float = 0
+    ) -> None:
         self.storage = storage
         self.state = self.storage.retrieve_state()
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self._pending = 0
+        self._dirty: Set[str] = set()
+        self._last_flush = monotonic()
+        self._transactions = 0
+        self._lock = threading.RLock()
+        atexit.register(self.flush)
 
     def set_state(self, key: str, value: Any) -> None:
         """Установить состояние для определённого ключа."""
-        self.state[key] = value
-        self.storage.save_state(self.state)
+        with self._lock:
+            self.state[key] = value
+            self._dirty.add(key)
+            self._pending += 1
+            if not self._transactions and (
+                self._pending >= self.flush_every
+                or monotonic() - self._last_flush >= self.flush_interval
+            ):
+                self.flush()
 
     def get_state(self, key: str) -> Any:
         """Получить состояние по определённому ключу."""
         return self.state.get(key, None)
+
+    def flush(self) -> None:
+        """Сохранить накопленные изменения в хранилище."""
+        with self._lock:
+            if self._dirty:
+                self.storage.save_changes(self.state, self._dirty)
+                self._dirty = set()
+                self._pending = 0
+            self._last_flush = monotonic()
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        """
+        Изменения внутри блока сохраняются вместе при выходе из него.
+
+        При исключении состояние в памяти возвращается к началу блока.
+        """
+        with self._lock:
+            snapshot = dict(self.state)
+            self._transactions += 1
+        try:
+            yield
+        except BaseException:
+            with self._lock:
+                self.state = snapshot
+                self._transactions -= 1
+            raise
+        with self._lock:
+            self._transactions -= 1
+            if not self._transactions:
+                self.flush()
+
+
+def create_state(config, shard: Optional[int] = None) -> State:
+    """
+    Создаёт State с хранилищем, выбранным в настройках (state_storage).
+
+    :param shard: Номер шарда; в JSON-режиме у каждого процесса-шарда свой
+        файл, т.к. файл целиком перезаписывается при сохранении.
+    """
+    if config.state_storage == "postgres":
+        storage = PostgresStorage(
+            psycopg.connect(
+                host=config.sql_host,
+                dbname=config.postgres_db,
+                user=config.postgres_user,
+                password=config.postgres_password,
+            )
+        )
+    elif config.state_storage == "redis":
+        storage = RedisStorage(config.redis_url)
+    else:
+        file_path = config.state_file
+        if shard is not None:
+            root, ext = os.path.splitext(file_path)
+            file_path = f"{root}.shard{shard}{ext}"
+        storage = JsonFileStorage(file_path)
+    return State(
+        storage,
+        flush_every=config.state_flush_every,
+        flush_interval=config.state_flush_interval,
+    )
@@ -0,0 +1,74 @@
+"""
+Повторы отправки готовых строк bulk-запроса без Elasticsearch.
+
+Запуск из корня репозитория: python -m pytest etl/tests
+"""
+
+from types import SimpleNamespace
+
+import pytest
+from elastic_transport import ApiResponseMeta, HttpHeaders, NodeConfig
+from elasticsearch import ApiError
+
+from etl import elastic
+from etl.elastic import ElasticSearchLoader
+
+ROWS = [{"action": b'{"index":{}}', "source": b"{}"} for _ in range(3)]
+
+
+def api_error(status):
+    meta = ApiResponseMeta(
+        status, "1.1", HttpHeaders(), 0.0, NodeConfig("http", "localhost", 9200)
+    )
+    return ApiError("rejected", meta, {})
+
+
+class FakeClient:
+    """Отвечает на bulk по очереди заданными ответами или исключениями."""
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.requests = []
+
+    def options(self, **kwargs):
+        return self
+
+    def bulk(self, operations):
+        self.requests.append(operations)
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+def make_loader(responses):
+    loader = ElasticSearchLoader.__new__(ElasticSearchLoader)
+    loader.config = SimpleNamespace(
+        bulk_request_timeout=1,
+        bulk_max_retries=2,
+        bulk_initial_backoff=0,
+        bulk_max_backoff=0,
+    )
+    loader.es = FakeClient(responses)
+    return loader
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(elastic, "sleep", lambda seconds: None)
+
+
+def test_rejected_request_is_sent_again():
+    loader = make_loader([api_error(429), {"errors": False, "items": []}])
+
+    assert loader._send_raw_chunk(ROWS) == len(ROWS)
+    assert len(loader.es.requests) == 2
+    assert loader.es.requests[1] == loader.es.requests[0]
+
+
+def test_other_request_errors_are_raised():
+    loader = make_loader([api_error(400)])
+
+    with pytest.raises(ApiError):
+        loader._send_raw_chunk(ROWS)
+    assert len(loader.es.requests) == 1
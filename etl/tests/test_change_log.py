@@ -0,0 +1,102 @@
+"""
+Очистка журнала изменений content.etl_change_log без PostgreSQL.
+
+Запуск из корня репозитория: python -m pytest etl/tests
+"""
+
+import datetime
+from types import SimpleNamespace
+from uuid import uuid4
+
+from etl.db_extractions import DBExtractions, shard_of
+from etl.elastic_extraction import ElasticExtraction
+from etl.state import BaseStorage, State
+
+NOW = datetime.datetime.now(datetime.timezone.utc)
+OLD = NOW - datetime.timedelta(days=30)
+
+
+class MemoryStorage(BaseStorage):
+    def __init__(self, state):
+        self.state = state
+
+    def save_state(self, state):
+        self.state = dict(state)
+
+    def retrieve_state(self):
+        return dict(self.state)
+
+
+class FakeCursor:
+    """
+    Выполняет DELETE журнала по строкам (id, film_work_id, changed_at)
+    в памяти; остальные запросы ничего не находят.
+    """
+
+    def __init__(self, log):
+        self.log = log
+
+    def execute(self, query, params, prepare=False):
+        if "DELETE" not in str(query):
+            return
+        *shard, consumed_id, retention_days = params
+        cutoff = NOW - datetime.timedelta(days=retention_days)
+        self.log[:] = [
+            row
+            for row in self.log
+            if not (
+                (not shard or shard_of(row[1], shard[0]) == shard[1])
+                and row[0] <= consumed_id
+                and row[2] < cutoff
+            )
+        ]
+
+    def fetchall(self):
+        return []
+
+    def close(self):
+        pass
+
+
+def make_extraction(log, state, shard=None):
+    setup = SimpleNamespace(
+        batch_size=10, change_log_retention_days=7, sql_documents=False
+    )
+    pg = DBExtractions.__new__(DBExtractions)
+    pg.config = setup
+    pg.shard = None if shard is None else (shard, 2)
+    pg.conn = SimpleNamespace(cursor=lambda: FakeCursor(log), commit=lambda: None)
+    extraction = ElasticExtraction.__new__(ElasticExtraction)
+    extraction.setup = setup
+    extraction.state = State(MemoryStorage(state))
+    extraction.shard = shard
+    extraction.pg = pg
+    return extraction
+
+
+def test_unconsumed_rows_are_kept():
+    log = [(log_id, uuid4(), OLD) for log_id in range(1, 6)]
+    extraction = make_extraction(log, {"last_change_log_id": 3})
+
+    extraction.sync_updates()
+
+    assert [row[0] for row in log] == [4, 5]
+
+
+def test_nothing_is_pruned_before_the_log_is_read():
+    log = [(log_id, uuid4(), OLD) for log_id in range(1, 6)]
+    extraction = make_extraction(log, {})
+
+    extraction.sync_updates()
+
+    assert len(log) == 5
+
+
+def test_shard_keeps_rows_of_other_shards():
+    log = [(log_id, uuid4(), OLD) for log_id in range(1, 21)]
+    extraction = make_extraction(log, {"last_change_log_id:shard0": 20}, shard=0)
+
+    extraction.sync_updates()
+
+    assert log
+    assert all(shard_of(row[1], 2) == 1 for row in log)
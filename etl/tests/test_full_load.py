@@ -0,0 +1,35 @@
+"""
+Позиции keyset-курсора полной загрузки без PostgreSQL.
+
+Запуск из корня репозитория: python -m pytest etl/tests
+"""
+
+import datetime
+from types import SimpleNamespace
+from uuid import uuid4
+
+from etl.db_extractions import NULL_MODIFIED
+from etl.elastic_extraction import ElasticExtraction
+
+MODIFIED = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def test_checkpoint_of_row_without_modified():
+    batches = [
+        [{"id": uuid4(), "modified": None}],
+        [{"id": uuid4(), "modified": MODIFIED}],
+    ]
+    extraction = ElasticExtraction.__new__(ElasticExtraction)
+    extraction.setup = SimpleNamespace(batch_size=1, sql_documents=False)
+    extraction.pg = SimpleNamespace(extract_data=lambda *args, **kwargs: batches)
+
+    checkpoints = [
+        checkpoint["position"]
+        for checkpoint, _ in extraction._iter_full_load("movies", None)
+    ]
+
+    assert checkpoints == [
+        [NULL_MODIFIED.isoformat(), str(batches[0][0]["id"])],
+        [MODIFIED.isoformat(), str(batches[1][0]["id"])],
+    ]
+    assert datetime.datetime.fromisoformat(checkpoints[0][0]) == NULL_MODIFIED
@@ -0,0 +1,86 @@
+"""
+Опрос изменений keyset-курсором (время, id) без PostgreSQL.
+
+Запуск из корня репозитория: python -m pytest etl/tests
+"""
+
+import datetime
+from types import SimpleNamespace
+from uuid import UUID, uuid4
+
+from etl.db_extractions import DBExtractions
+
+MODIFIED = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+class FakeCursor:
+    """Выполняет запрос опроса по строкам (object_id, время, id) в памяти."""
+
+    def __init__(self, rows, queries):
+        self.rows = rows
+        self.queries = queries
+        self.results = []
+
+    def execute(self, query, params, prepare=False):
+        time, row_id, limit = params
+        position = (time, UUID(str(row_id)))
+        self.queries.append(params)
+        found = [row for row in self.rows if (row[1], row[2]) > position]
+        self.results = sorted(found, key=lambda row: (row[1], row[2]))[:limit]
+
+    def fetchall(self):
+        return self.results
+
+    def close(self):
+        pass
+
+
+def make_extractions(rows, batch_size):
+    queries = []
+    pg = DBExtractions.__new__(DBExtractions)
+    pg.config = SimpleNamespace(batch_size=batch_size)
+    pg.shard = None
+    pg.conn = SimpleNamespace(cursor=lambda: FakeCursor(rows, queries))
+    return pg, queries
+
+
+def poll(pg, since=None):
+    """Цикл опроса, как в ElasticExtraction._collect_changes."""
+    ids = []
+    while changed := pg.get_updated_objects_ids("film_work", since):
+        batch, since = changed
+        ids.extend(batch)
+    return ids, since
+
+
+def test_rows_with_same_modified_are_not_dropped():
+    rows = [(fw_id, MODIFIED, fw_id) for fw_id in (uuid4() for _ in range(25))]
+    pg, queries = make_extractions(rows, batch_size=10)
+
+    ids, since = poll(pg)
+
+    assert sorted(ids) == sorted(row[0] for row in rows)
+    # По запросу на каждую из трёх пачек и один пустой в конце.
+    assert len(queries) == 4
+    assert since == [MODIFIED.isoformat(), str(max(row[2] for row in rows))]
+
+
+def test_resume_inside_group_with_same_modified():
+    rows = sorted((fw_id, MODIFIED, fw_id) for fw_id in (uuid4() for _ in range(5)))
+    pg, _ = make_extractions(rows, batch_size=2)
+
+    ids, _ = poll(pg, since=[MODIFIED.isoformat(), str(rows[1][2])])
+
+    assert ids == [row[0] for row in rows[2:]]
+
+
+def test_time_only_watermark_starts_at_first_row_of_that_time():
+    earlier = MODIFIED - datetime.timedelta(seconds=1)
+    rows = [(uuid4(), earlier, uuid4())] + [
+        (fw_id, MODIFIED, fw_id) for fw_id in (uuid4() for _ in range(3))
+    ]
+    pg, _ = make_extractions(rows, batch_size=2)
+
+    ids, _ = poll(pg, since=MODIFIED.isoformat())
+
+    assert sorted(ids) == sorted(row[0] for row in rows[1:])
@@ -0,0 +1,74 @@
+"""
+Создание версий индекса без Elasticsearch.
+
+Запуск из корня репозитория: python -m pytest etl/tests
+"""
+
+import time
+from types import SimpleNamespace
+
+import pytest
+from elasticsearch import ConnectionTimeout
+
+from etl.elastic import ElasticSearchLoader
+from etl.settings import settings_hash
+
+BODY = {"mappings": {"properties": {"id": {"type": "keyword"}}}}
+SETTINGS = {"movies": BODY}
+
+
+class FakeIndices:
+    """
+    Индексы в памяти; первые timeouts запросов create создают индекс,
+    но завершаются таймаутом.
+    """
+
+    def __init__(self, indices=None, timeouts=0):
+        self.indices = indices or {}
+        self.timeouts = timeouts
+
+    def get(self, index, expand_wildcards=None):
+        prefix = index.rstrip("*")
+        return {
+            name: body for name, body in self.indices.items() if name.startswith(prefix)
+        }
+
+    def create(self, index, body):
+        self.indices[index] = {"aliases": {}, "mappings": body["mappings"]}
+        if self.timeouts:
+            self.timeouts -= 1
+            raise ConnectionTimeout("Connection timed out")
+
+
+def make_loader(indices):
+    loader = ElasticSearchLoader.__new__(ElasticSearchLoader)
+    loader.es = SimpleNamespace(indices=indices)
+    return loader
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(time, "sleep", lambda seconds: None)
+
+
+def test_timed_out_create_is_not_repeated():
+    indices = FakeIndices(timeouts=1)
+
+    index_name = make_loader(indices).create_versioned_index(None, "movies", SETTINGS)
+
+    assert index_name == "movies_v1"
+    assert list(indices.indices) == ["movies_v1"]
+
+
+def test_aliased_or_other_schema_versions_are_not_reused():
+    meta = {"_meta": {"settings_hash": settings_hash(BODY)}}
+    indices = FakeIndices(
+        {
+            "movies_v1": {"aliases": {"movies": {}}, "mappings": meta},
+            "movies_v2": {"aliases": {}, "mappings": {"_meta": {}}},
+        }
+    )
+
+    index_name = make_loader(indices).create_versioned_index(None, "movies", SETTINGS)
+
+    assert index_name == "movies_v3"